@@ -0,0 +1,338 @@
+"""
+適応的な信号送信
+送信した信号を受信機で受け取り（ループバック）、欠けずに送信できたことを確認します。
+欠けていた場合だけ再送します（受信できなかった場合は確認できなかったものとして再送しない）。
+ループバックで分かるのはLEDが欠けずに信号を出したことだけで、エアコンが受け付けたかどうかは分かりません。
+そのため送信間隔は短くせず、設定した間隔（既定は従来の固定の待ち時間）を次の送信の前にだけ空けます。
+"""
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+from fingerprint import same_signal
+from ticks import ticks_ms, ticks_diff, sleep_ms
+
+
+class LoopbackListener:
+    """受信機で待ち受けながら送信し、受信したパルス列を返す"""
+    def __init__(self, recorder, margin_ms=150):
+        """
+        Args:
+            recorder (IrSignalRecorder): capture()を持つ信号ライブラリ（受信機）
+            margin_ms (int): 信号の長さに加えて待ち受ける時間
+        """
+        self.recorder = recorder
+        self.margin_ms = margin_ms
+
+    def available(self):
+        return _thread is not None
+
+    def listen(self, send, duration_ms):
+        """
+        受信を開始してからsend()を呼び出し、受信したパルス列を返す
+
+        Returns:
+            list: 受信したパルス列。受信できなかった場合はNone
+        """
+        timeout_ms = duration_ms + self.margin_ms
+        if self.recorder.listening:
+            # 常時受信中は、受信スレッドが受け取った自分の信号を取り出す
+            self.recorder.clear_pending()
+            send()
+            return self.recorder.capture(timeout_ms)
+
+        state = {'armed': False, 'done': False, 'pulses': None}
+
+        def worker():
+            try:
+                state['armed'] = True
+                state['pulses'] = self.recorder.capture(timeout_ms)
+            finally:
+                state['done'] = True
+
+        _thread.start_new_thread(worker, ())
+        # 受信の開始を待ってから送信する
+        start = ticks_ms()
+        while not state['armed'] and ticks_diff(ticks_ms(), start) < 50:
+            sleep_ms(1)
+        sleep_ms(2)
+        send()
+        start = ticks_ms()
+        while not state['done'] and ticks_diff(ticks_ms(), start) < timeout_ms:
+            sleep_ms(1)
+        return state['pulses']
+
+
+class AdaptiveTransmitter:
+    """送信機ごとの適応的な送信（ループバック確認・再送・送信間隔の管理）"""
+    # ループバックで受信できないことがこの回数続いたら確認をやめる
+    ECHO_GIVE_UP = 3
+
+    def __init__(self, emitter, listener=None, max_attempts=3, gap_ms=1100,
+                 history=32, reprobe_ms=600000, clock=None, sleep=None):
+        """
+        Args:
+            emitter (IrEmitter): 送信機
+            listener: listen(send, duration_ms)を持つループバック受信（Noneの場合は確認しない）
+            max_attempts (int): 1回の操作で送信する最大回数
+            gap_ms (int): 前の送信が終わってから次の送信までの間隔（エアコンが受け付けられる間隔）
+            history (int): 遅延の中央値を求めるために保持する操作数
+            reprobe_ms (int): 確認をやめてから、再び確認を試すまでの時間
+        """
+        self.emitter = emitter
+        self.listener = listener
+        self.loopback = listener is not None and listener.available()
+        self.max_attempts = max_attempts
+        self.gap_ms = gap_ms
+        self.history = history
+        self.reprobe_ms = reprobe_ms
+        self.clock = clock or ticks_ms
+        self.sleep = sleep or sleep_ms
+        self._last_end = None
+        self._echo_misses = 0
+        self._loopback_off_at = None
+        # 統計
+        self.commands = 0
+        self.attempts = 0
+        self.retries = 0
+        self.verified = 0
+        self.unverified = 0
+        self.failures = 0
+        self.latencies = []
+        self.last_attempts = 0
+        self.last_latency_ms = 0
+
+    def wait_ready(self):
+        """前回の送信から送信間隔が経つまで待つ"""
+        if self._last_end is None:
+            return
+        remaining = self.gap_ms - ticks_diff(self.clock(), self._last_end)
+        if remaining > 0:
+            self.sleep(remaining)
+
+    def mark_sent(self):
+        """送信が終わった時刻を記録"""
+        self._last_end = self.clock()
+
+    def _send_once(self, signal_data):
+        """
+        1回送信する
+
+        Returns:
+            tuple: (送信できたか, ループバックで受信したパルス列)
+        """
+        result = {'sent': False}
+
+        def send():
+            result['sent'] = self.emitter.send(signal_data)
+
+        if not self.loopback:
+            send()
+            return result['sent'], None
+        duration_ms = sum(signal_data) // 1000
+        pulses = self.listener.listen(send, duration_ms)
+        return result['sent'], pulses
+
+    def send(self, signal_data):
+        """
+        信号を送信し、ループバックで確認できるまで再送する
+
+        Returns:
+            bool: 送信できた場合はTrue（ループバックで欠けた信号しか受信できなかった場合のみFalse）
+        """
+        start = self.clock()
+        self._maybe_reprobe()
+        attempts = 0
+        success = False
+        while attempts < self.max_attempts:
+            self.wait_ready()
+            attempts += 1
+            sent, echo = self._send_once(signal_data)
+            self.mark_sent()
+            if not sent:
+                continue
+            if not self.loopback:
+                success = True
+                break
+            if echo is None:
+                # 受信できなかった場合は送信済み・未確認として扱い、再送しない
+                success = True
+                self.unverified += 1
+                self._echo_misses += 1
+                if self._echo_misses >= self.ECHO_GIVE_UP:
+                    # 受信機から送信機が見えない設置（または見えなくなった）とみなして確認をやめる
+                    print(f"ループバックを受信できないため確認を無効にします ({self.emitter.name})")
+                    self.loopback = False
+                    self._loopback_off_at = self.clock()
+                break
+            self._echo_misses = 0
+            if same_signal(signal_data, echo):
+                success = True
+                # 確認できたのはLEDから欠けずに出たことだけで、送信間隔の判断には使わない
+                self.verified += 1
+                break
+            # 欠けていた場合は送信間隔を空けて再送
+
+        latency_ms = ticks_diff(self.clock(), start)
+        self.commands += 1
+        self.attempts += attempts
+        self.retries += attempts - 1
+        if not success:
+            self.failures += 1
+        self.last_attempts = attempts
+        self.last_latency_ms = latency_ms
+        self.latencies.append(latency_ms)
+        if len(self.latencies) > self.history:
+            self.latencies.pop(0)
+        return success
+
+    def _maybe_reprobe(self):
+        """確認をやめてからreprobe_msが経ったら、次の1回だけ確認を試す"""
+        if self._loopback_off_at is None:
+            return
+        if ticks_diff(self.clock(), self._loopback_off_at) < self.reprobe_ms:
+            return
+        self._loopback_off_at = None
+        self.loopback = True
+        # 再び受信できなければ、その1回で確認をやめる
+        self._echo_misses = self.ECHO_GIVE_UP - 1
+
+    def median_latency_ms(self):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[len(ordered) // 2]
+
+    def stats(self):
+        """送信の統計を取得"""
+        return {
+            'loopback': self.loopback,
+            'gap_ms': self.gap_ms,
+            'commands': self.commands,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'verified': self.verified,
+            'unverified': self.unverified,
+            'failures': self.failures,
+            'last_attempts': self.last_attempts,
+            'last_latency_ms': self.last_latency_ms,
+            'median_latency_ms': self.median_latency_ms(),
+        }
+
+
+def send_group(transmitters, jobs):
+    """
+    複数の送信機から同時に送信する
+    同時に送信すると受信機で信号が重なるため、ループバックでの確認は行わず、送信間隔だけを守る
+
+    Args:
+        transmitters (dict): 送信機名 -> AdaptiveTransmitter
+        jobs (list): [(IrEmitter, signal_data), ...]
+    """
+    from emitter import fire_concurrently
+    for emitter, signal_data in jobs:
+        transmitters[emitter.name].wait_ready()
+    results = fire_concurrently(jobs)
+    for emitter, _ in jobs:
+        transmitters[emitter.name].mark_sent()
+    return results
+
+
+class _VirtualClock:
+    """シミュレーション用の仮想時計"""
+    def __init__(self):
+        self.now = 0
+
+    def ticks(self):
+        return self.now
+
+    def sleep(self, ms):
+        self.now += int(ms)
+
+
+class _SimulatedEmitter:
+    def __init__(self, clock):
+        self.name = 'sim'
+        self.clock = clock
+
+    def send(self, signal_data):
+        self.clock.sleep(sum(signal_data) // 1000)
+        return True
+
+
+class _SimulatedLoopback:
+    """
+    見通しの悪い設置を模したループバック
+    一定の確率で信号が欠けて届き（エアコンも受け取れない）、または受信機だけが受け取れない（エアコンには届いている）
+    """
+    def __init__(self, clock, rng, p_corrupt, p_miss, settle_ms=20):
+        self.clock = clock
+        self.rng = rng
+        self.p_corrupt = p_corrupt
+        self.p_miss = p_miss
+        self.settle_ms = settle_ms
+        self.delivered = 0  # エアコンに欠けずに届いた回数
+
+    def available(self):
+        return True
+
+    def listen(self, send, duration_ms):
+        send()
+        self.clock.sleep(self.settle_ms)
+        r = self.rng.random()
+        signal = self.current_signal
+        if r < self.p_corrupt:
+            return signal[len(signal) // 3:]
+        self.delivered += 1
+        if r < self.p_corrupt + self.p_miss:
+            return None
+        return signal
+
+
+def simulate(commands=200, p_corrupt=0.15, p_miss=0.05, signal_path='signal_data/power_on/true/mode_cool/temp_25/fan_3.json', seed=0):
+    """
+    従来の固定待ち（1回送信して1.1秒待つ）と適応的な送信を比較する
+    適応的な送信も同じ間隔を空けるが、次の送信の前にだけ待つため、単発の操作は待たずに応答できる
+
+    Returns:
+        dict: 方式ごとの遅延の中央値・成功率・送信回数
+    """
+    import json
+    import random
+    with open(signal_path) as f:
+        signal_data = json.load(f)["signal_data"]
+
+    results = {}
+    # 従来: 1回だけ送信して固定で待つ（欠けていても気づかない）
+    rng = random.Random(seed)
+    delivered = 0
+    latency_ms = sum(signal_data) // 1000 + 1100
+    for _ in range(commands):
+        if rng.random() >= p_corrupt:
+            delivered += 1
+    results['fixed'] = {'median_latency_ms': latency_ms, 'success_rate': delivered / commands, 'sends': commands}
+
+    # 適応的な送信
+    clock = _VirtualClock()
+    loopback = _SimulatedLoopback(clock, random.Random(seed), p_corrupt, p_miss)
+    loopback.current_signal = signal_data
+    transmitter = AdaptiveTransmitter(_SimulatedEmitter(clock), loopback, clock=clock.ticks, sleep=clock.sleep)
+    for _ in range(commands):
+        transmitter.send(signal_data)
+        # 次の操作まで間を空ける（UIからの操作を想定）
+        clock.sleep(5000)
+    results['adaptive'] = {
+        'median_latency_ms': transmitter.median_latency_ms(),
+        'success_rate': min(loopback.delivered, commands) / commands,
+        'sends': transmitter.attempts,
+    }
+    return results
+
+
+# 使用例（ホスト上でのシミュレーション）
+if __name__ == "__main__":
+    for p_corrupt, p_miss in ((0.0, 0.0), (0.15, 0.05), (0.3, 0.1)):
+        print(f"=== 欠け {int(p_corrupt * 100)}%, 受信機のみ無受信 {int(p_miss * 100)}% ===")
+        for name, r in simulate(p_corrupt=p_corrupt, p_miss=p_miss).items():
+            print(f"{name}: 遅延の中央値 {r['median_latency_ms']}ms, 成功率 {r['success_rate']:.3f}, 送信回数 {r['sends']}")
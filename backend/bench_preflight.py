@@ -0,0 +1,170 @@
+"""
+CORSプリフライト処理の計測（ホスト上でのシミュレーション）
+ブラウザからの操作1回あたりにESP32側で処理するリクエスト数と処理時間を、
+プリフライトを通常のルーティングで処理する場合と、エンコード済みの応答で即答する場合で比較します。
+
+ブラウザはプリフライトの結果をクエリを含むURLごとにキャッシュするため、
+即答する場合でも、Max-Ageの期間内に初めて使うURL（設定の組み合わせ）ごとにプリフライトが発生します。
+操作はUIで1項目ずつ設定を変える流れを模しており、同じ組み合わせに戻った時だけキャッシュが効きます。
+
+使い方:
+    python bench_preflight.py
+"""
+import random
+import sys
+import time
+import types
+
+# ホスト上ではmachine/networkが無いため、サーバーの生成に必要な最小限だけを用意する
+if 'machine' not in sys.modules:
+    class _Pin:
+        OUT = 1
+
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def value(self, v=None):
+            return 0
+    sys.modules['machine'] = types.SimpleNamespace(Pin=_Pin)
+    sys.modules['network'] = types.SimpleNamespace()
+for _name in ('ticks_us', 'ticks_ms', 'ticks_diff'):
+    if not hasattr(time, _name):
+        import ticks
+        setattr(time, _name, getattr(ticks, _name))
+
+from esp32_wifi_server import ESP32Server, WiFiConfig
+
+PREFLIGHT = (b"OPTIONS {} HTTP/1.1\r\n"
+             b"Host: 192.168.0.10\r\n"
+             b"Origin: https://example.vercel.app\r\n"
+             b"Access-Control-Request-Method: GET\r\n"
+             b"Access-Control-Request-Headers: content-type\r\n"
+             b"\r\n")
+REQUEST = (b"GET {} HTTP/1.1\r\n"
+           b"Host: 192.168.0.10\r\n"
+           b"Origin: https://example.vercel.app\r\n"
+           b"Content-Type: application/json\r\n"
+           b"\r\n")
+
+
+class _Socket:
+    """送受信を記録するだけのソケット"""
+    def __init__(self, data):
+        self.data = data
+        self.sent = 0
+
+    def recv(self, size):
+        return self.data[:size]
+
+    def send(self, data):
+        self.sent += len(data)
+
+    def close(self):
+        pass
+
+
+def ui_session(actions=100, seed=0):
+    """
+    UIでの操作列を生成する（1回の操作で温度・風量・モード・電源のいずれか1つを変える）
+
+    Returns:
+        list: 操作ごとの/aircon/controlのURL
+    """
+    rng = random.Random(seed)
+    state = {'power_on': 'true', 'mode': 'cool', 'temperature': 25, 'fan_speed': 3}
+    urls = []
+    for _ in range(actions):
+        r = rng.random()
+        if r < 0.6:
+            state['temperature'] = max(18, min(30, state['temperature'] + rng.choice((-1, 1))))
+        elif r < 0.8:
+            state['fan_speed'] = rng.randint(1, 3)
+        elif r < 0.9:
+            state['mode'] = 'heat' if state['mode'] == 'cool' else 'cool'
+        else:
+            state['power_on'] = 'false' if state['power_on'] == 'true' else 'true'
+        urls.append("/aircon/control?power_on={power_on}&mode={mode}&temperature={temperature}&fan_speed={fan_speed}".format(**state))
+    return urls
+
+
+def _make_server(fast_preflight, calls):
+    server = ESP32Server(WiFiConfig('ssid', 'pass'), fast_preflight=fast_preflight)
+
+    # 制御そのものの処理時間は比較に含めず、ハンドラ（実機では赤外線を送信する）の呼び出し回数だけ数える
+    def control(params):
+        calls[0] += 1
+        return {'status': 'success', 'message': 'OK'}, 200
+    server.add_route('/aircon/control', control)
+    server.add_route('/aircon/status', lambda params: ({'status': 'success'}, 200), methods=('GET',), headers=('If-None-Match',))
+    return server
+
+
+def _time_request(server, template, url, repeat):
+    data = template.replace(b'{}', url.encode())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        client = _Socket(data)
+        server.handle_request(client)
+    return (time.perf_counter() - start) / repeat * 1e6, client.sent
+
+
+def _run(fast_preflight, urls, repeat):
+    calls = [0]
+    server = _make_server(fast_preflight, calls)
+    preflight_us, preflight_bytes = _time_request(server, PREFLIGHT, urls[0], repeat)
+    request_us, request_bytes = _time_request(server, REQUEST, urls[0], repeat)
+    if fast_preflight:
+        # Max-Ageの期間内は、ブラウザは初めて使うURLの時だけプリフライトを送る
+        preflights = len(set(urls))
+    else:
+        # キャッシュできる応答を返さないため、毎回プリフライトが送られる
+        preflights = len(urls)
+    # 実際に各リクエストを処理してハンドラの呼び出し回数を数える
+    calls[0] = 0
+    seen = set()
+    for url in urls:
+        if not fast_preflight or url not in seen:
+            server.handle_request(_Socket(PREFLIGHT.replace(b'{}', url.encode())))
+            seen.add(url)
+        server.handle_request(_Socket(REQUEST.replace(b'{}', url.encode())))
+    return {
+        'preflight_us': preflight_us,
+        'request_us': request_us,
+        'preflights': preflights,
+        'requests': preflights + len(urls),
+        'handler_calls': calls[0],
+        'total_us': preflights * preflight_us + len(urls) * request_us,
+        'bytes': preflights * preflight_bytes + len(urls) * request_bytes,
+    }
+
+
+def benchmark(urls=None, repeat=2000):
+    """
+    Args:
+        urls (list): Max-Ageの期間内にUIで行う操作のURL（Noneの場合はui_session()）
+        repeat (int): 1リクエストあたりの処理時間を計測する回数
+
+    Returns:
+        dict: 方式ごとのリクエスト数・ハンドラの呼び出し回数・処理時間
+    """
+    if urls is None:
+        urls = ui_session()
+    return {
+        # 従来: プリフライトも通常のリクエストとしてルーティングされ、制御のハンドラが実行される
+        'routed': _run(False, urls, repeat),
+        # 新方式: エンコード済みの応答で即答し、Max-Ageの間は同じURLへのプリフライトをブラウザが省略する
+        'short_circuit': _run(True, urls, repeat),
+    }
+
+
+# 使用例
+if __name__ == "__main__":
+    urls = ui_session()
+    print(f"=== UI操作{len(urls)}回（異なるURL {len(set(urls))}種類）あたりのESP32側の処理 ===")
+    results = benchmark(urls)
+    for name, r in results.items():
+        print(f"{name}: リクエスト {r['requests']}件（うちプリフライト {r['preflights']}件）, ハンドラ {r['handler_calls']}回, "
+              f"プリフライト {r['preflight_us']:.1f}us/件, 本リクエスト {r['request_us']:.1f}us/件, "
+              f"合計 {r['total_us'] / 1000:.2f}ms, 送信 {r['bytes']:,} bytes")
+    ratio = results['short_circuit']['total_us'] / results['routed']['total_us']
+    print(f"処理時間の比: {ratio:.2f}")
@@ -0,0 +1,38 @@
+"""
+起動時間の計測
+importや初期化、WiFi接続などの各段階にかかった時間を記録し、起動後にまとめて表示します。
+"""
+from ticks import ticks_ms, ticks_us, ticks_diff
+
+
+class BootProfiler:
+    """起動の各段階の所要時間を記録するクラス"""
+    def __init__(self):
+        self.laps = []  # [(名前, 所要時間[us], リセットからの時間[ms]), ...]
+        self._last = ticks_us()
+
+    def lap(self, name):
+        """前回の記録からの経過時間を記録"""
+        now = ticks_us()
+        self.laps.append((name, ticks_diff(now, self._last), ticks_ms()))
+        self._last = now
+
+    def record(self, name, duration_us):
+        """別に計測した所要時間を記録"""
+        self.laps.append((name, duration_us, ticks_ms()))
+        self._last = ticks_us()
+
+    def report(self):
+        """記録した時間を表示"""
+        print("\n=== 起動時間 ===")
+        total_us = 0
+        for name, duration_us, since_reset_ms in self.laps:
+            total_us += duration_us
+            print(f"{name:<24} {duration_us / 1000:>9.1f} ms  (リセットから {since_reset_ms} ms)")
+        print(f"{'合計':<24} {total_us / 1000:>9.1f} ms")
+        print("================\n")
+        return self.laps
+
+
+# main.pyと各モジュールで共有する計測器
+profiler = BootProfiler()
@@ -0,0 +1,111 @@
+"""
+ESP32へ書き込むファイルのビルド（ホスト上で実行）
+.envから設定モジュール(config.py)を生成し、バックエンドのモジュールをmpy-crossで.mpyバイトコードに変換します。
+.mpyは起動時のパースとコンパイルが不要なため、起動が速くなります。
+
+使い方:
+    pip install mpy-cross
+    python build_mpy.py [--env .env] [--out build] [--march xtensawin]
+    mpremote cp -r build/* :
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# .mpyに変換するモジュール
+MODULES = [
+    'boot_profile.py',
+    'ticks.py',
+    'esp32_wifi_server.py',
+    'record_data.py',
+    'fingerprint.py',
+    'sensor.py',
+    'thermostat.py',
+    'journal.py',
+    'emitter.py',
+    'device_state.py',
+    'signal_model.py',
+    'adaptive_tx.py',
+]
+
+# main.pyはエアコン制御本体をaircon_main.mpyとして変換し、起動用の小さなmain.pyを置く
+MAIN_MODULE = 'aircon_main'
+MAIN_STUB = """import aircon_main
+aircon_main.run()
+"""
+
+
+def read_env(path):
+    """.envファイルを読み込む（dotenvは使わない）"""
+    values = {}
+    if not os.path.exists(path):
+        return values
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#') or '=' not in line:
+                continue
+            key, value = line.split('=', 1)
+            values[key.strip()] = value.strip().strip('"').strip("'")
+    return values
+
+
+def write_config(values, path):
+    """設定値を定数として持つPythonモジュールを生成"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('# build_mpy.pyで.envから生成（編集しないでください）\n')
+        for key in sorted(values):
+            f.write('{} = {!r}\n'.format(key, values[key]))
+
+
+def compile_module(mpy_cross, src, dst, march):
+    """mpy-crossで.mpyに変換"""
+    command = [mpy_cross, '-o', dst, '-O2']
+    if march:
+        command.append('-march=' + march)
+    command.append(src)
+    subprocess.run(command, check=True)
+
+
+def build(env_path, out_dir, march):
+    mpy_cross = shutil.which('mpy-cross')
+    if mpy_cross is None:
+        print('mpy-crossが見つかりません（pip install mpy-cross）')
+        return False
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 設定モジュール
+    values = read_env(env_path)
+    config_src = os.path.join(out_dir, 'config.py')
+    write_config(values, config_src)
+    compile_module(mpy_cross, config_src, os.path.join(out_dir, 'config.mpy'), march)
+    os.remove(config_src)
+    print(f'config.mpy: {len(values)}件の設定')
+
+    # バックエンドのモジュール
+    for name in MODULES:
+        dst = os.path.join(out_dir, name[:-3] + '.mpy')
+        compile_module(mpy_cross, os.path.join(BACKEND_DIR, name), dst, march)
+        print(f'{name} -> {os.path.basename(dst)}')
+
+    compile_module(mpy_cross, os.path.join(BACKEND_DIR, 'main.py'),
+                   os.path.join(out_dir, MAIN_MODULE + '.mpy'), march)
+    with open(os.path.join(out_dir, 'main.py'), 'w', encoding='utf-8') as f:
+        f.write(MAIN_STUB)
+    print(f'main.py -> {MAIN_MODULE}.mpy（起動用のmain.pyを生成）')
+    return True
+
+
+# 使用例
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='バックエンドを.mpyバイトコードにビルド')
+    parser.add_argument('--env', default=os.path.join(BACKEND_DIR, '.env'), help='.envファイル')
+    parser.add_argument('--out', default=os.path.join(BACKEND_DIR, 'build'), help='出力先')
+    parser.add_argument('--march', default='xtensawin', help='mpy-crossのアーキテクチャ（ESP32はxtensawin）')
+    args = parser.parse_args()
+    sys.exit(0 if build(args.env, args.out, args.march) else 1)
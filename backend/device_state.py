@@ -0,0 +1,69 @@
+"""
+エアコンの状態の記録
+送信機ごとに最後に送信・検出した状態を、時刻と操作元（api / thermostat / remote）付きで保持します。
+状態が実際に変わった時だけバージョンを進め、登録されたリスナーに通知します。
+"""
+import json
+import random
+import time
+
+
+class DeviceState:
+    """送信機ごとのエアコンの状態"""
+    def __init__(self, clock=None):
+        self.clock = clock or time.time
+        self.units = {}       # 送信機名 -> {'key': (power_on, mode, temperature, fan_speed), 'timestamp', 'source'}
+        self.version = 0
+        self.listeners = []   # 状態が変わった時に呼ばれる関数 listener(state)
+        # 再起動前のETagと衝突しないように、起動ごとに異なる値を付ける
+        self._boot_id = random.getrandbits(16)
+        self._json = None
+
+    def get(self, unit, default=None):
+        """送信機の状態 (power_on, mode, temperature, fan_speed) を取得"""
+        record = self.units.get(unit)
+        return default if record is None else record['key']
+
+    def update(self, unit, key, source):
+        """
+        状態を更新する
+
+        Returns:
+            bool: 状態が変わった場合はTrue
+        """
+        record = self.units.get(unit)
+        if record is not None and record['key'] == key:
+            return False
+        self.units[unit] = {'key': key, 'timestamp': int(self.clock()), 'source': source}
+        self.version += 1
+        self._json = None
+        for listener in self.listeners:
+            try:
+                listener(self)
+            except Exception as e:
+                print(f"状態通知エラー: {e}")
+        return True
+
+    def etag(self):
+        """現在の状態を表すETag"""
+        return '"{:x}-{}"'.format(self._boot_id, self.version)
+
+    def to_dict(self):
+        units = {}
+        for unit, record in self.units.items():
+            power_on, mode, temperature, fan_speed = record['key']
+            units[unit] = {
+                'power_on': power_on,
+                'mode': mode,
+                'temperature': temperature,
+                'fan_speed': fan_speed,
+                'timestamp': record['timestamp'],
+                'source': record['source'],
+            }
+        return {'status': 'success', 'version': self.version, 'units': units}
+
+    def to_json(self):
+        """JSON文字列（状態が変わるまでキャッシュ）"""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict())
+        return self._json
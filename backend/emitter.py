@@ -0,0 +1,127 @@
+"""
+赤外線送信機（エミッター）
+RMTチャンネルとピンごとに送信機を分け、それぞれが自分の信号ライブラリ（名前空間）を持ちます。
+複数の送信機へ同時に送信することで、複数台のエアコンをまとめて操作できます。
+"""
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+from ticks import ticks_ms, ticks_diff, sleep_ms
+
+
+class IrEmitter:
+    """名前付きの赤外線送信機"""
+    def __init__(self, name, ir_tx, recorder, channel=None, tx_pin=None):
+        """
+        Args:
+            name (str): 送信機の名前
+            ir_tx: send(signal_list)を持つ送信器（UpyIrTxなど）
+            recorder (IrSignalRecorder): この送信機用の信号ライブラリ
+            channel (int): RMTチャンネル
+            tx_pin (int): 送信ピン
+        """
+        self.name = name
+        self.ir_tx = ir_tx
+        self.recorder = recorder
+        self.channel = channel
+        self.tx_pin = tx_pin
+
+    def send(self, signal_data):
+        """信号を送信"""
+        return self.ir_tx.send(signal_data) is not False
+
+
+def fire_concurrently(jobs, timeout_ms=5000):
+    """
+    複数の送信機から同時に信号を送信する
+
+    Args:
+        jobs (list): [(IrEmitter, signal_data), ...]
+        timeout_ms (int): 全ての送信を待つ最大時間
+
+    Returns:
+        list: 送信機ごとの成否（jobsと同じ順序）
+    """
+    results = [False] * len(jobs)
+
+    def run(i):
+        emitter, signal_data = jobs[i]
+        try:
+            results[i] = emitter.send(signal_data)
+        except Exception as e:
+            print(f"信号送信エラー ({emitter.name}): {e}")
+            results[i] = False
+
+    if len(jobs) <= 1 or _thread is None:
+        # 1台の場合（またはスレッドが使えない場合）は順番に送信
+        for i in range(len(jobs)):
+            run(i)
+        return results
+
+    lock = _thread.allocate_lock()
+    remaining = [len(jobs) - 1]
+
+    def worker(i):
+        try:
+            run(i)
+        finally:
+            with lock:
+                remaining[0] -= 1
+
+    # 最後の1台は呼び出し元のスレッドで送信する
+    for i in range(len(jobs) - 1):
+        _thread.start_new_thread(worker, (i,))
+    run(len(jobs) - 1)
+
+    start = ticks_ms()
+    while remaining[0] > 0 and ticks_diff(ticks_ms(), start) < timeout_ms:
+        sleep_ms(1)
+    return results
+
+
+class _SimulatedTx:
+    """シミュレーション用の送信器（信号の長さだけ待つ）"""
+    def send(self, signal_data):
+        sleep_ms(sum(signal_data) // 1000)
+        return True
+
+
+def simulate(units=(1, 2, 4), signal_path='signal_data/power_on/true/mode_cool/temp_25/fan_3.json', gap_ms=1000):
+    """
+    N台への送信にかかる時間を、1台ずつ送信する場合と同時送信する場合で比較する
+
+    Returns:
+        dict: 台数 -> (順番に送信した時間[ms], 同時に送信した時間[ms])
+    """
+    import json
+    with open(signal_path) as f:
+        signal_data = json.load(f)["signal_data"]
+
+    results = {}
+    for n in units:
+        emitters = [IrEmitter(f"unit{i}", _SimulatedTx(), None, channel=i) for i in range(n)]
+
+        # 従来の方法: 1台ずつ送信して待つ
+        start = ticks_ms()
+        for emitter in emitters:
+            emitter.send(signal_data)
+            sleep_ms(gap_ms)
+        serial_ms = ticks_diff(ticks_ms(), start)
+
+        # 同時に送信して、待ち時間は1回だけ
+        start = ticks_ms()
+        fire_concurrently([(emitter, signal_data) for emitter in emitters])
+        sleep_ms(gap_ms)
+        concurrent_ms = ticks_diff(ticks_ms(), start)
+
+        results[n] = (serial_ms, concurrent_ms)
+    return results
+
+
+# 使用例（ホスト上でのシミュレーション）
+if __name__ == "__main__":
+    print("=== 複数台への送信時間 ===")
+    for n, (serial_ms, concurrent_ms) in simulate().items():
+        print(f"{n}台: 順番に送信 {serial_ms}ms, 同時に送信 {concurrent_ms}ms")
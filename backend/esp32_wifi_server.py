@@ -4,6 +4,16 @@ import json
 from machine import Pin
 import time
 
+STATUS_TEXT = {
+    200: 'OK',
+    204: 'No Content',
+    304: 'Not Modified',
+    400: 'Bad Request',
+    404: 'Not Found',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+
 class WiFiConfig:
     """WiFi設定を管理するクラス"""
     def __init__(self, ssid, password, static_ip=None, subnet_mask=None, gateway=None, dns=None):
@@ -24,6 +34,10 @@ class WiFiManager:
         wlan = network.WLAN(network.STA_IF)
         wlan.active(True)
         
+        # ソフトリセット後などで既に接続済みの場合はそのまま使う
+        if wlan.isconnected():
+            return wlan.ifconfig()[0]
+        
         # 固定IPアドレスが設定されている場合は適用
         if self.config.static_ip:
             wlan.ifconfig((
@@ -35,13 +49,13 @@ class WiFiManager:
         
         wlan.connect(self.config.ssid, self.config.password)
         
-        # 接続を待機
-        max_wait = 10
+        # 接続を待機（最大10秒、接続したらすぐに抜けるよう0.1秒ごとに確認）
+        max_wait = 100
         while max_wait > 0:
             if wlan.isconnected():
                 break
             max_wait -= 1
-            time.sleep(1)
+            time.sleep(0.1)
         
         if not wlan.isconnected():
             raise Exception('WiFi接続に失敗しました')
@@ -54,15 +68,23 @@ class HTTPRequest:
         self.method = None
         self.path = None
         self.params = {}
+        self.headers = {}  # ヘッダ名は小文字
         self._parse_request()
     
     def _parse_request(self):
         """生のHTTPリクエストを解析"""
         try:
             # リクエストの最初の行を取得
-            first_line = self.raw_request.split('\r\n')[0]
+            head = self.raw_request.split('\r\n\r\n', 1)[0].split('\r\n')
+            first_line = head[0]
             self.method, path_with_params = first_line.split(' ')[:2]
             
+            # ヘッダを解析
+            for line in head[1:]:
+                if ':' in line:
+                    name, value = line.split(':', 1)
+                    self.headers[name.strip().lower()] = value.strip()
+            
             # パスとパラメータを分離
             if '?' in path_with_params:
                 self.path, param_str = path_with_params.split('?', 1)
@@ -79,15 +101,101 @@ class HTTPRequest:
             self.method = 'GET'
             self.path = '/'
             self.params = {}
+            self.headers = {}
+
+class EventStream:
+    """Server-Sent Eventsの購読者を管理し、イベントを配信するクラス"""
+    def __init__(self, max_subscribers=4, keepalive_ms=15000):
+        # ESP32で同時に開けるソケット数には限りがあるため、購読者数に上限を設ける
+        self.max_subscribers = max_subscribers
+        self.keepalive_ms = keepalive_ms
+        self.subscribers = []
+        self._last_sent = time.ticks_ms()
+    
+    def subscribe(self, client_socket, initial_event=None, initial_data=None):
+        """
+        購読を開始する（ソケットは開いたままにする）
+        
+        Returns:
+            bool: 購読を開始できた場合はTrue
+        """
+        if len(self.subscribers) >= self.max_subscribers:
+            return False
+        header = "HTTP/1.1 200 OK\r\n"
+        header += "Content-Type: text/event-stream\r\n"
+        header += "Cache-Control: no-cache\r\n"
+        header += "Connection: keep-alive\r\n"
+        header += "Access-Control-Allow-Origin: *\r\n"
+        header += "\r\n"
+        # 遅い購読者で処理が止まらないように送信のタイムアウトを短くする
+        client_socket.settimeout(1)
+        client_socket.send(header.encode('utf-8'))
+        if initial_event is not None:
+            client_socket.send(self._format(initial_event, initial_data))
+        self.subscribers.append(client_socket)
+        return True
+    
+    def _format(self, event, data):
+        return "event: {}\ndata: {}\n\n".format(event, data).encode('utf-8')
+    
+    def publish(self, event, data):
+        """全ての購読者にイベントを送信"""
+        if self.subscribers:
+            self._send_all(self._format(event, data))
+    
+    def keepalive(self):
+        """一定時間送信が無ければコメント行を送り、切断された購読者を検出する"""
+        if self.subscribers and time.ticks_diff(time.ticks_ms(), self._last_sent) >= self.keepalive_ms:
+            self._send_all(b": keepalive\n\n")
+    
+    def _send_all(self, message):
+        self._last_sent = time.ticks_ms()
+        for client_socket in list(self.subscribers):
+            try:
+                client_socket.send(message)
+            except OSError:
+                # 切断された購読者を削除
+                self.subscribers.remove(client_socket)
+                try:
+                    client_socket.close()
+                except OSError:
+                    pass
 
 class RouteHandler:
     """ルーティングを処理するクラス"""
     def __init__(self):
         self.routes = {}
+        # ソケットを直接扱うルート（ストリーミング用）
+        self.stream_routes = {}
+        # ルートごとに受け付けるメソッドとリクエストヘッダ（CORSのプリフライト応答に使う）
+        self.route_methods = {}
+        self.route_headers = {}
     
-    def add_route(self, path, handler):
+    def add_route(self, path, handler, methods=('GET', 'POST'), headers=('Content-Type',)):
         """ルートを追加"""
         self.routes[path] = handler
+        self.route_methods[path] = methods
+        self.route_headers[path] = headers
+    
+    def add_stream_route(self, path, handler, methods=('GET',), headers=()):
+        """ソケットを直接扱うルートを追加（handler(client_socket, request)がソケットを引き継ぐ）"""
+        self.stream_routes[path] = handler
+        self.route_methods[path] = methods
+        self.route_headers[path] = headers
+    
+    def allowed_methods(self):
+        """登録されたルートで使われるメソッドの一覧"""
+        methods = set(['OPTIONS'])
+        for route_methods in self.route_methods.values():
+            methods.update(route_methods)
+        return sorted(methods)
+    
+    def allowed_headers(self):
+        """登録されたルートで使われるリクエストヘッダの一覧"""
+        headers = set()
+        for route_headers in self.route_headers.values():
+            headers.update(route_headers)
+        return sorted(headers)
     
     def handle_request(self, request):
         """リクエストを処理"""
@@ -98,9 +206,20 @@ class RouteHandler:
 
 class ESP32Server:
     """ESP32のWebサーバー"""
-    def __init__(self, wifi_config, port=80, led_connected_pin=22, led_disconnected_pin=23):
+    def __init__(self, wifi_config, port=80, led_connected_pin=22, led_disconnected_pin=23, idle_interval=1.0,
+                 listen_first=False, profiler=None, cors_max_age=7200, fast_preflight=True):
         self.wifi_config = wifi_config
         self.port = port
+        self.idle_interval = idle_interval  # on_idleを呼ぶ間隔（秒）
+        # WiFi接続より先にソケットを開くか（起動を速くするため）
+        self.listen_first = listen_first
+        # 起動時間の計測（Noneの場合は計測しない）
+        self.profiler = profiler
+        # CORSのプリフライト応答をブラウザにキャッシュさせる時間（秒）
+        self.cors_max_age = cors_max_age
+        # プリフライトをルーティングせずに、エンコード済みの応答で返すか
+        self.fast_preflight = fast_preflight
+        self._preflight_response = None
         self.wifi_manager = WiFiManager(wifi_config)
         self.route_handler = RouteHandler()
         
@@ -111,73 +230,147 @@ class ESP32Server:
         self.led_connected.value(0)
         self.led_disconnected.value(1)
     
-    def add_route(self, path, handler):
+    def add_route(self, path, handler, methods=('GET', 'POST'), headers=('Content-Type',)):
         """ルートを追加"""
-        self.route_handler.add_route(path, handler)
+        self.route_handler.add_route(path, handler, methods, headers)
+        self._preflight_response = None
+    
+    def add_stream_route(self, path, handler, methods=('GET',), headers=()):
+        """ストリーミング用のルートを追加"""
+        self.route_handler.add_stream_route(path, handler, methods, headers)
+        self._preflight_response = None
+    
+    def _get_preflight_response(self):
+        """CORSのプリフライト応答（ルートが変わるまでエンコード済みのものを使い回す）"""
+        if self._preflight_response is None:
+            response = "HTTP/1.1 204 No Content\r\n"
+            response += "Access-Control-Allow-Origin: *\r\n"
+            response += "Access-Control-Allow-Methods: {}\r\n".format(', '.join(self.route_handler.allowed_methods()))
+            response += "Access-Control-Allow-Headers: {}\r\n".format(', '.join(self.route_handler.allowed_headers()))
+            response += "Access-Control-Max-Age: {}\r\n".format(self.cors_max_age)
+            response += "Content-Length: 0\r\n"
+            response += "\r\n"
+            self._preflight_response = response.encode('utf-8')
+        return self._preflight_response
     
     def handle_request(self, client_socket):
         """クライアントからのリクエストを処理"""
+        start = time.ticks_us()
         try:
             # リクエストを受信
-            request = client_socket.recv(1024).decode('utf-8')
-            if not request:
+            data = client_socket.recv(1024)
+            if not data:
+                client_socket.close()
+                return
+            
+            # プリフライトは解析やルーティングをせずに応答する
+            if self.fast_preflight and data.startswith(b'OPTIONS '):
+                client_socket.send(self._get_preflight_response())
+                client_socket.close()
+                self._record_first_response(start)
                 return
+            request = data.decode('utf-8')
             
             # リクエストを解析
             http_request = HTTPRequest(request)
             
-            # ルートハンドラで処理
-            response_data, status_code = self.route_handler.handle_request(http_request)
-            
-            # シンプルなJSONレスポンスを生成
-            json_str = '{"status":"success","message":"OK"}'
+            # ストリーミング用のルートはソケットをハンドラに引き継ぐ
+            stream_handler = self.route_handler.stream_routes.get(http_request.path)
+            if stream_handler is not None:
+                stream_handler(client_socket, http_request)
+                self._record_first_response(start)
+                return
             
-            # レスポンスを生成
-            response = "HTTP/1.1 200 OK\r\n"
-            response += "Content-Type: application/json\r\n"
-            response += "Access-Control-Allow-Origin: *\r\n"
-            response += "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
-            response += "Access-Control-Allow-Headers: Content-Type\r\n"
-            response += "Content-Length: {}\r\n".format(len(json_str))
-            response += "\r\n"
-            response += json_str
+            # ルートハンドラで処理（ヘッダを追加する場合は3つ目の要素で指定）
+            result = self.route_handler.handle_request(http_request)
+            response_data, status_code = result[0], result[1]
+            headers = result[2] if len(result) > 2 else None
             
-            # レスポンスを送信
-            client_socket.send(response.encode('utf-8'))
+            # 条件付きGET: ETagが一致すれば本文を送らない
+            etag = headers.get('ETag') if headers else None
+            if etag is not None and http_request.headers.get('if-none-match') == etag:
+                client_socket.send(self._build_response(304, None, headers))
+            else:
+                # 文字列の場合はJSON変換済みとしてそのまま送る
+                body = response_data if isinstance(response_data, str) else json.dumps(response_data)
+                client_socket.send(self._build_response(status_code, body, headers))
             client_socket.close()
+            self._record_first_response(start)
             
         except Exception as e:
             print(f"リクエスト処理エラー: {e}")
             error_json = '{"status":"error","message":"Internal Server Error"}'
-            error_response = "HTTP/1.1 500 Internal Server Error\r\n"
-            error_response += "Content-Type: application/json\r\n"
-            error_response += "Access-Control-Allow-Origin: *\r\n"
-            error_response += "Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
-            error_response += "Access-Control-Allow-Headers: Content-Type\r\n"
-            error_response += "Content-Length: {}\r\n".format(len(error_json))
-            error_response += "\r\n"
-            error_response += error_json
-            client_socket.send(error_response.encode('utf-8'))
+            client_socket.send(self._build_response(500, error_json))
             client_socket.close()
+            self._record_first_response(start)
+    
+    def _record_first_response(self, start):
+        """起動後最初のレスポンスまでの時間を記録（プリフライトやストリームへの応答を含む）"""
+        if self.profiler is None:
+            return
+        self.profiler.record('first response', time.ticks_diff(time.ticks_us(), start))
+        self.profiler.report()
+        self.profiler = None
+    
+    def _build_response(self, status_code, body, headers=None):
+        """JSONレスポンスを生成"""
+        body = body.encode('utf-8') if body is not None else b''
+        response = "HTTP/1.1 {} {}\r\n".format(status_code, STATUS_TEXT.get(status_code, 'OK'))
+        response += "Content-Type: application/json\r\n"
+        response += "Access-Control-Allow-Origin: *\r\n"
+        response += "Access-Control-Expose-Headers: ETag\r\n"
+        if headers:
+            for name, value in headers.items():
+                response += "{}: {}\r\n".format(name, value)
+        response += "Content-Length: {}\r\n".format(len(body))
+        response += "\r\n"
+        return response.encode('utf-8') + body
+    
+    def on_idle(self):
+        """リクエストを待っている間に定期的に呼ばれる処理（サブクラスで上書き）"""
+        pass
+    
+    def _lap(self, name):
+        if self.profiler is not None:
+            self.profiler.lap(name)
+    
+    def _open_socket(self):
+        """待ち受け用のソケットを開く"""
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('', self.port))
+        s.listen(5)
+        # 待機中もon_idleを呼べるようにタイムアウトを設定
+        s.settimeout(self.idle_interval)
+        self._lap('socket bind')
+        return s
     
     def start(self):
         """サーバーを開始"""
         try:
+            s = self._open_socket() if self.listen_first else None
             ip_address = self.wifi_manager.connect()
+            self._lap('wifi connect')
             # WiFi接続成功時
             self.led_connected.value(1)
             self.led_disconnected.value(0)
             print(f'サーバーを開始しました。ポート: {self.port}')
             print(f'アクセスURL: http://{ip_address}')
             
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.bind(('', self.port))
-            s.listen(5)
+            if s is None:
+                s = self._open_socket()
             
             while True:
-                client, addr = s.accept()
+                try:
+                    client, addr = s.accept()
+                except OSError:
+                    # タイムアウト
+                    self.on_idle()
+                    continue
                 print('クライアント接続:', addr)
+                client.settimeout(None)
                 self.handle_request(client)
+                self.on_idle()
                 
         except Exception as e:
             # WiFi接続失敗時
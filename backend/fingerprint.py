@@ -0,0 +1,212 @@
+"""
+赤外線信号のフィンガープリント
+受信したパルス列を基本単位で量子化し、フレームごとの短いハッシュに変換します。
+学習済み信号のフィンガープリントから索引を作っておくことで、純正リモコンの操作を
+全信号との比較なしに(power_on, mode, temperature, fan_speed)へ対応付けられます。
+"""
+
+# 量子化した記号（基本単位の何倍か）
+SYMBOL_SHORT = 0    # 約1倍（データのマーク・"0"のスペース）
+SYMBOL_LONG = 1     # 約3〜4倍（"1"のスペース・リーダーのスペース）
+SYMBOL_HEADER = 2   # 約8倍（リーダーのマーク）
+SYMBOL_GAP = 3      # フレーム間の空白
+
+# 記号の境界（基本単位に対する比）。各記号の中間に置くことでジッタを吸収する
+SHORT_LIMIT = 2.0
+LONG_LIMIT = 6.0
+HEADER_LIMIT = 20.0
+
+# 短すぎるフレーム（ノイズ）は無視する
+MIN_FRAME_SYMBOLS = 16
+
+FNV_OFFSET = 0x811c9dc5
+FNV_PRIME = 0x01000193
+
+
+def estimate_unit(pulses):
+    """基本単位（最も多い短いパルスの長さ）を下位四分位から推定"""
+    ordered = sorted(pulses)
+    return max(1, ordered[len(ordered) // 4])
+
+
+def quantize(pulses, unit=None):
+    """パルス長のリストを記号のリストに変換"""
+    unit = unit or estimate_unit(pulses)
+    short_limit = unit * SHORT_LIMIT
+    long_limit = unit * LONG_LIMIT
+    header_limit = unit * HEADER_LIMIT
+    symbols = bytearray(len(pulses))
+    for i, pulse in enumerate(pulses):
+        if pulse < short_limit:
+            symbols[i] = SYMBOL_SHORT
+        elif pulse < long_limit:
+            symbols[i] = SYMBOL_LONG
+        elif pulse < header_limit:
+            symbols[i] = SYMBOL_HEADER
+        else:
+            symbols[i] = SYMBOL_GAP
+    return symbols
+
+
+def split_frames(symbols):
+    """記号列をフレーム間の空白で分割"""
+    frames = []
+    start = 0
+    for i, symbol in enumerate(symbols):
+        if symbol == SYMBOL_GAP:
+            if i - start >= MIN_FRAME_SYMBOLS:
+                frames.append(symbols[start:i])
+            start = i + 1
+    if len(symbols) - start >= MIN_FRAME_SYMBOLS:
+        frames.append(symbols[start:])
+    return frames
+
+
+def hash_frame(frame):
+    """フレームの記号列を32bitのハッシュ（FNV-1a）に変換"""
+    h = FNV_OFFSET
+    for symbol in frame:
+        h = ((h ^ symbol) * FNV_PRIME) & 0xffffffff
+    # 長さも含めて、途中で切れたフレームと区別する
+    return ((h ^ len(frame)) * FNV_PRIME) & 0xffffffff
+
+
+def fingerprints(pulses):
+    """
+    パルス列からフレームごとのフィンガープリントを生成
+
+    Returns:
+        list: フレームごとのハッシュ値
+    """
+    if not pulses:
+        return []
+    return [hash_frame(frame) for frame in split_frames(quantize(pulses))]
+
+
+def same_signal(sent, received):
+    """
+    受信したパルス列に、送信した信号の全てのフレームが含まれているか
+    （自分の送信を受信して、欠けずに送信できたか確認するために使う）
+    """
+    expected = fingerprints(sent)
+    if not expected or not received:
+        return False
+    actual = fingerprints(received)
+    return all(fp in actual for fp in expected)
+
+
+def signal_key(signal):
+    """信号データから(power_on, mode, temperature, fan_speed)のキーを生成"""
+    def to_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+    return (
+        bool(signal["power_on"]),
+        signal["mode"],
+        to_int(signal["temperature"]),
+        to_int(signal["fan_speed"])
+    )
+
+
+class FingerprintIndex:
+    """フィンガープリントから信号のキーを引く索引"""
+    # 複数の信号に共通するフレーム（どの操作か区別できない）
+    AMBIGUOUS = object()
+
+    def __init__(self, signals=None):
+        self.index = {}
+        for signal in signals or []:
+            self.add(signal)
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, signal):
+        """学習済み信号を索引に追加"""
+        key = signal_key(signal)
+        for fp in fingerprints(signal["signal_data"]):
+            existing = self.index.get(fp)
+            if existing is None:
+                self.index[fp] = key
+            elif existing != key:
+                self.index[fp] = self.AMBIGUOUS
+
+    def match(self, pulses):
+        """
+        受信したパルス列に対応するキーを検索
+
+        Returns:
+            tuple: (power_on, mode, temperature, fan_speed)。一致しない場合はNone
+        """
+        for fp in fingerprints(pulses):
+            key = self.index.get(fp)
+            if key is not None and key is not self.AMBIGUOUS:
+                return key
+        return None
+
+
+def _jitter(pulses, rng, ratio):
+    """各パルスにランダムな揺らぎを加える"""
+    return [max(1, int(p * (1 + (rng.random() * 2 - 1) * ratio))) for p in pulses]
+
+
+def benchmark(signal_dir='signal_data', trials=2000, jitter=0.15, seed=0):
+    """
+    学習済み信号に揺らぎを加えた合成キャプチャで、照合速度と誤一致率を計測
+
+    Returns:
+        dict: 計測結果
+    """
+    import json
+    import os
+    import random
+    import time
+
+    signals = []
+    for root, _, files in os.walk(signal_dir):
+        for name in files:
+            if name.endswith('.json') and name != 'model.json':
+                with open(os.path.join(root, name)) as f:
+                    signals.append(json.load(f))
+    index = FingerprintIndex(signals)
+    rng = random.Random(seed)
+
+    captures = []
+    for _ in range(trials):
+        signal = rng.choice(signals)
+        pulses = _jitter(signal["signal_data"], rng, jitter)
+        if rng.random() < 0.5:
+            # 学習していない信号（データ部分の1ビットを反転）を混ぜる
+            data_start = len(pulses) - 2 * rng.randint(10, 100) - 1
+            pulses[data_start] = pulses[data_start] * 3 if pulses[data_start] < 800 else pulses[data_start] // 3
+            captures.append((pulses, None))
+        else:
+            captures.append((pulses, signal_key(signal)))
+
+    start = time.perf_counter()
+    results = [index.match(pulses) for pulses, _ in captures]
+    elapsed = time.perf_counter() - start
+
+    true_match = sum(1 for (_, expected), got in zip(captures, results) if expected is not None and got == expected)
+    false_match = sum(1 for (_, expected), got in zip(captures, results) if got is not None and got != expected)
+    known = sum(1 for _, expected in captures if expected is not None)
+    return {
+        'signals': len(signals),
+        'index_entries': len(index),
+        'trials': trials,
+        'matches_per_s': int(trials / elapsed),
+        'true_match_rate': true_match / known,
+        'false_match_rate': false_match / trials,
+    }
+
+
+# 使用例（ホスト上での計測）
+if __name__ == "__main__":
+    for jitter in (0.05, 0.15, 0.25):
+        result = benchmark(jitter=jitter)
+        print(f"=== 揺らぎ ±{int(jitter * 100)}% ===")
+        print(f"信号数: {result['signals']}, 索引: {result['index_entries']}件")
+        print(f"照合速度: {result['matches_per_s']:,}件/秒")
+        print(f"正解率: {result['true_match_rate']:.3f}, 誤一致率: {result['false_match_rate']:.4f}")
@@ -0,0 +1,455 @@
+"""
+イベントジャーナル
+制御・学習・エラー・センサー値をコンパクトなバイナリレコードとしてRAM上の固定長バッファに追記し、
+バッファが満杯になったらフラッシュのセグメントファイルへ退避、まとめて圧縮してアップロードします。
+アップロードは別スレッドで行うため、リクエスト処理を待たせません。
+"""
+import struct
+import time
+import io
+
+try:
+    import uos as os
+except ImportError:
+    import os
+
+try:
+    import _thread
+except ImportError:
+    _thread = None
+
+from ticks import ticks_ms, ticks_diff
+
+# レコードの種類
+EVENT_CONTROL = 1
+EVENT_LEARN = 2
+EVENT_ERROR = 3
+EVENT_SENSOR = 4
+
+EVENT_NAMES = {
+    EVENT_CONTROL: 'control',
+    EVENT_LEARN: 'learn',
+    EVENT_ERROR: 'error',
+    EVENT_SENSOR: 'sensor',
+}
+
+# ヘッダ: 種類(1) + 時刻[秒](4) + ペイロード長(1)
+HEADER_FORMAT = '<BIB'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+# 制御・学習: フラグ(1) + 温度(1) + 風量(1) + 処理時間[ms](2)
+COMMAND_FORMAT = '<BBBH'
+# センサー: 温度×100(2)
+SENSOR_FORMAT = '<h'
+MAX_MESSAGE_BYTES = 64
+
+FLAG_POWER_ON = 0x01
+FLAG_MODE_HEAT = 0x02
+FLAG_SUCCESS = 0x04
+
+
+def _to_byte(value):
+    """数値を1バイトに収める（数値でない場合は0）"""
+    try:
+        return max(0, min(255, int(value)))
+    except (TypeError, ValueError):
+        return 0
+
+
+def compress(data):
+    """
+    データをzlib形式で圧縮
+
+    Returns:
+        tuple: (圧縮後のデータ, エンコーディング名)。圧縮できない環境では('identity')
+    """
+    try:
+        import zlib
+        if hasattr(zlib, 'compress'):
+            return zlib.compress(data), 'deflate'
+    except ImportError:
+        pass
+    try:
+        # MicroPython 1.21以降
+        import deflate
+        stream = io.BytesIO()
+        with deflate.DeflateIO(stream, deflate.ZLIB) as d:
+            d.write(data)
+        return stream.getvalue(), 'deflate'
+    except (ImportError, AttributeError, NotImplementedError):
+        return bytes(data), 'identity'
+
+
+def decode_records(data):
+    """
+    バイナリレコードを辞書に変換（受信側・デバッグ用）
+
+    Yields:
+        dict: イベント
+    """
+    offset = 0
+    while offset + HEADER_SIZE <= len(data):
+        event_type, timestamp, length = struct.unpack_from(HEADER_FORMAT, data, offset)
+        offset += HEADER_SIZE
+        payload = bytes(data[offset:offset + length])
+        offset += length
+        event = {'type': EVENT_NAMES.get(event_type, event_type), 'time': timestamp}
+        if event_type in (EVENT_CONTROL, EVENT_LEARN):
+            flags, temperature, fan_speed, latency_ms = struct.unpack(COMMAND_FORMAT, payload)
+            event['power_on'] = bool(flags & FLAG_POWER_ON)
+            event['mode'] = 'heat' if flags & FLAG_MODE_HEAT else 'cool'
+            event['temperature'] = temperature
+            event['fan_speed'] = fan_speed
+            event['success'] = bool(flags & FLAG_SUCCESS)
+            event['latency_ms'] = latency_ms
+        elif event_type == EVENT_SENSOR:
+            event['temperature'] = struct.unpack(SENSOR_FORMAT, payload)[0] / 100
+        elif event_type == EVENT_ERROR:
+            event['message'] = payload.decode('utf-8', 'ignore')
+        yield event
+
+
+class LocalSink:
+    """送信先の代わりにバッチを保持するシンク（計測・テスト用）"""
+    def __init__(self):
+        self.batches = []
+        self.bytes_sent = 0
+
+    def send(self, payload, encoding):
+        self.batches.append((payload, encoding))
+        self.bytes_sent += len(payload)
+        return True
+
+
+class HttpSink:
+    """HTTP POSTでバッチを送信するシンク"""
+    def __init__(self, host, port=80, path='/journal', timeout=5):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.timeout = timeout
+
+    def send(self, payload, encoding):
+        import socket
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.settimeout(self.timeout)
+            s.connect(socket.getaddrinfo(self.host, self.port)[0][-1])
+            header = "POST {} HTTP/1.1\r\n".format(self.path)
+            header += "Host: {}\r\n".format(self.host)
+            header += "Content-Type: application/octet-stream\r\n"
+            header += "Content-Encoding: {}\r\n".format(encoding)
+            header += "Content-Length: {}\r\n".format(len(payload))
+            header += "Connection: close\r\n"
+            header += "\r\n"
+            s.send(header.encode('utf-8'))
+            s.send(payload)
+            status_line = s.recv(64).decode('utf-8')
+            return ' 200 ' in status_line or ' 204 ' in status_line
+        finally:
+            s.close()
+
+
+class MqttSink:
+    """MQTTでバッチを送信するシンク（umqtt.simpleを使用）"""
+    def __init__(self, client_id, server, topic='aircon/journal', port=1883, user=None, password=None):
+        self.client_id = client_id
+        self.server = server
+        self.topic = topic
+        self.port = port
+        self.user = user
+        self.password = password
+
+    def send(self, payload, encoding):
+        from umqtt.simple import MQTTClient
+        client = MQTTClient(self.client_id, self.server, port=self.port, user=self.user, password=self.password)
+        client.connect()
+        try:
+            client.publish("{}/{}".format(self.topic, encoding), payload)
+            return True
+        finally:
+            client.disconnect()
+
+
+class EventJournal:
+    """イベントをバッファリングして、まとめてアップロードするジャーナル"""
+    def __init__(self, sink=None, buffer_size=1024, base_dir='journal', max_segments=16,
+                 upload_interval_ms=60000, upload_threshold=4096, use_thread=True, clock=None):
+        """
+        Args:
+            sink: send(payload, encoding)を持つ送信先（Noneの場合はフラッシュに保持するのみ）
+            buffer_size (int): RAMバッファのサイズ（バイト）
+            base_dir (str): セグメントファイルの保存先
+            max_segments (int): 保持するセグメント数の上限（超えた場合は古いものから削除）
+            upload_interval_ms (int): 定期アップロードの間隔
+            upload_threshold (int): この量（バイト）が溜まったらアップロード
+            use_thread (bool): アップロードを別スレッドで行うか
+        """
+        self.sink = sink
+        self.buffer = bytearray(buffer_size)
+        self.base_dir = base_dir
+        self.max_segments = max_segments
+        self.upload_interval_ms = upload_interval_ms
+        self.upload_threshold = upload_threshold
+        self.use_thread = use_thread and _thread is not None
+        self.clock = clock or time.time
+        self._offset = 0
+        self._segments = []
+        self._in_flight = ()   # アップロード中のセグメント（破棄の対象にしない）
+        self._next_segment = 0
+        self._spilled_bytes = 0
+        self._lock = _thread.allocate_lock() if _thread else None
+        self._uploading = False
+        self._last_upload = ticks_ms()
+        # 統計
+        self.events = 0
+        self.dropped_segments = 0
+        self.spill_errors = 0
+        self.dropped_bytes = 0
+        self.raw_bytes_uploaded = 0
+        self.bytes_uploaded = 0
+        self.batches_uploaded = 0
+        self.upload_errors = 0
+        self._ensure_directory()
+
+    def _ensure_directory(self):
+        try:
+            os.mkdir(self.base_dir)
+        except OSError:
+            pass  # ディレクトリが既に存在する場合は無視
+        # 再起動前に送信できなかったセグメントを引き継ぐ
+        try:
+            names = sorted(n for n in os.listdir(self.base_dir) if n.startswith('seg_'))
+        except OSError:
+            names = []
+        for name in names:
+            path = self.base_dir + '/' + name
+            self._segments.append(path)
+            self._spilled_bytes += os.stat(path)[6]
+            self._next_segment = max(self._next_segment, int(name[4:-4]) + 1)
+
+    # --- 記録 ---
+
+    def log_command(self, event_type, power_on, mode, temperature, fan_speed, success, latency_ms=0):
+        """制御・学習イベントを記録"""
+        flags = (FLAG_POWER_ON if power_on else 0) | (FLAG_MODE_HEAT if mode == 'heat' else 0) | (FLAG_SUCCESS if success else 0)
+        payload = struct.pack(COMMAND_FORMAT, flags, _to_byte(temperature), _to_byte(fan_speed), max(0, min(65535, int(latency_ms))))
+        self._append(event_type, payload)
+
+    def log_control(self, power_on, mode, temperature, fan_speed, success, latency_ms=0):
+        self.log_command(EVENT_CONTROL, power_on, mode, temperature, fan_speed, success, latency_ms)
+
+    def log_learn(self, power_on, mode, temperature, fan_speed, success, latency_ms=0):
+        self.log_command(EVENT_LEARN, power_on, mode, temperature, fan_speed, success, latency_ms)
+
+    def log_error(self, message):
+        """エラーを記録（メッセージは先頭64バイトまで）"""
+        self._append(EVENT_ERROR, str(message).encode('utf-8')[:MAX_MESSAGE_BYTES])
+
+    def log_sensor(self, temperature):
+        """センサー値を記録"""
+        self._append(EVENT_SENSOR, struct.pack(SENSOR_FORMAT, int(round(temperature * 100))))
+
+    def _append(self, event_type, payload):
+        size = HEADER_SIZE + len(payload)
+        if self._offset + size > len(self.buffer):
+            self._spill()
+        struct.pack_into(HEADER_FORMAT, self.buffer, self._offset, event_type, int(self.clock()), len(payload))
+        self.buffer[self._offset + HEADER_SIZE:self._offset + size] = payload
+        self._offset += size
+        self.events += 1
+
+    def _spill(self):
+        """RAMバッファの内容をフラッシュのセグメントへ書き出す"""
+        if not self._offset:
+            return
+        path = "{}/seg_{:05d}.bin".format(self.base_dir, self._next_segment)
+        try:
+            with open(path, 'wb') as f:
+                f.write(memoryview(self.buffer)[:self._offset])
+        except OSError as e:
+            # フラッシュの空きが無いなどで書き出せない場合は、バッファの内容を捨てて記録を続ける
+            print(f"ジャーナル書き出しエラー: {e}")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.spill_errors += 1
+            self.dropped_bytes += self._offset
+            self._offset = 0
+            return
+        self._next_segment += 1
+        self._with_lock(self._add_segment, path, self._offset)
+        self._offset = 0
+
+    def _add_segment(self, path, size):
+        self._segments.append(path)
+        self._spilled_bytes += size
+        # 上限を超えたら、アップロード中のものを除いて最も古いセグメントを破棄
+        # （アップロード中のものしか無い場合は、送信が終わるまで一時的に上限を超えて保持する）
+        while len(self._segments) > self.max_segments:
+            for oldest in self._segments:
+                if oldest not in self._in_flight and oldest != path:
+                    break
+            else:
+                return
+            self._remove_segment(oldest)
+            self.dropped_segments += 1
+
+    def _remove_segment(self, path):
+        if path not in self._segments:
+            return
+        try:
+            self._spilled_bytes -= os.stat(path)[6]
+            os.remove(path)
+        except OSError:
+            pass
+        self._segments.remove(path)
+
+    def _with_lock(self, func, *args):
+        if self._lock is None:
+            return func(*args)
+        with self._lock:
+            return func(*args)
+
+    # --- アップロード ---
+
+    def pending_bytes(self):
+        """未送信のデータ量（バイト）"""
+        return self._offset + self._spilled_bytes
+
+    def maybe_upload(self):
+        """
+        スケジュールまたは量の閾値に達していればアップロードを開始する
+        （アイドル時に呼び出す）
+
+        Returns:
+            bool: アップロードを開始した場合はTrue
+        """
+        if self.sink is None or self._uploading or not self.pending_bytes():
+            return False
+        elapsed = ticks_diff(ticks_ms(), self._last_upload)
+        if self.pending_bytes() < self.upload_threshold and elapsed < self.upload_interval_ms:
+            return False
+        return self.upload()
+
+    def upload(self):
+        """溜まっているイベントのアップロードを開始"""
+        if self.sink is None or self._uploading:
+            return False
+        self._spill()
+        self._uploading = True
+        self._last_upload = ticks_ms()
+        if self.use_thread:
+            _thread.start_new_thread(self._upload_segments, ())
+        else:
+            self._upload_segments()
+        return True
+
+    def _upload_segments(self):
+        """セグメントをまとめて圧縮し、送信に成功したら削除する"""
+        try:
+            segments = self._with_lock(self._begin_upload)
+            if not segments:
+                return
+            batch = bytearray()
+            for path in segments:
+                with open(path, 'rb') as f:
+                    batch.extend(f.read())
+            payload, encoding = compress(batch)
+            if self.sink.send(payload, encoding):
+                for path in segments:
+                    self._with_lock(self._remove_segment, path)
+                self.raw_bytes_uploaded += len(batch)
+                self.bytes_uploaded += len(payload)
+                self.batches_uploaded += 1
+            else:
+                self.upload_errors += 1
+        except Exception as e:
+            print(f"ジャーナル送信エラー: {e}")
+            self.upload_errors += 1
+        finally:
+            self._in_flight = ()
+            self._uploading = False
+
+    def _begin_upload(self):
+        """送信するセグメントを確定し、送信が終わるまで破棄されないようにする"""
+        self._in_flight = tuple(self._segments)
+        return self._in_flight
+
+    def stats(self):
+        """統計を取得"""
+        return {
+            'events': self.events,
+            'pending_bytes': self.pending_bytes(),
+            'segments': len(self._segments),
+            'dropped_segments': self.dropped_segments,
+            'spill_errors': self.spill_errors,
+            'dropped_bytes': self.dropped_bytes,
+            'batches_uploaded': self.batches_uploaded,
+            'raw_bytes_uploaded': self.raw_bytes_uploaded,
+            'bytes_uploaded': self.bytes_uploaded,
+            'upload_errors': self.upload_errors,
+        }
+
+
+def benchmark(events=10000, buffer_size=1024, base_dir='journal_bench'):
+    """
+    ローカルシンクを使ってエクスポートのスループットとバッチ化による削減量を計測
+
+    Returns:
+        dict: 計測結果
+    """
+    import json
+    sink = LocalSink()
+    journal = EventJournal(sink, buffer_size=buffer_size, base_dir=base_dir, max_segments=events, use_thread=False)
+    # 1イベントごとにJSONをHTTP POSTした場合のリクエストヘッダ相当
+    per_event_overhead = len("POST /journal HTTP/1.1\r\nHost: example.com\r\nContent-Type: application/json\r\nContent-Length: 000\r\n\r\n")
+    naive_bytes = 0
+
+    start = ticks_ms()
+    for i in range(events):
+        if i % 4 == 0:
+            journal.log_sensor(25.0 + (i % 50) / 10)
+            event = {'type': 'sensor', 'time': int(time.time()), 'temperature': 25.0 + (i % 50) / 10}
+        else:
+            journal.log_control(True, 'cool', 23 + i % 3, 3, True, 120)
+            event = {'type': 'control', 'time': int(time.time()), 'power_on': True, 'mode': 'cool',
+                     'temperature': 23 + i % 3, 'fan_speed': 3, 'success': True, 'latency_ms': 120}
+        naive_bytes += per_event_overhead + len(json.dumps(event))
+        journal.maybe_upload()
+    journal.upload()
+    elapsed_ms = max(1, ticks_diff(ticks_ms(), start))
+
+    decoded = sum(len(list(decode_records(_decompress(p, e)))) for p, e in sink.batches)
+    try:
+        os.rmdir(base_dir)
+    except OSError:
+        pass
+    return {
+        'events': events,
+        'decoded_events': decoded,
+        'elapsed_ms': elapsed_ms,
+        'events_per_s': events * 1000 // elapsed_ms,
+        'batches': len(sink.batches),
+        'raw_bytes': journal.raw_bytes_uploaded,
+        'uploaded_bytes': sink.bytes_sent,
+        'naive_bytes': naive_bytes,
+    }
+
+
+def _decompress(payload, encoding):
+    if encoding == 'identity':
+        return payload
+    import zlib
+    return zlib.decompress(payload)
+
+
+# 使用例（ホスト上での計測）
+if __name__ == "__main__":
+    result = benchmark()
+    print("=== ジャーナル計測結果 ===")
+    print(f"イベント数: {result['events']}（復元: {result['decoded_events']}）")
+    print(f"処理時間: {result['elapsed_ms']}ms（{result['events_per_s']}件/秒）")
+    print(f"バッチ数: {result['batches']}")
+    print(f"バイナリ: {result['raw_bytes']:,} bytes -> 圧縮後: {result['uploaded_bytes']:,} bytes")
+    print(f"1件ずつJSONを送った場合: {result['naive_bytes']:,} bytes")
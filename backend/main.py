@@ -1,18 +1,47 @@
+from boot_profile import profiler
 import json
 from machine import Pin
-import UpyIrTx
 import time
-from record_data import IrSignalRecorder
-from esp32_wifi_server import WiFiConfig, ESP32Server
-import socket
 import gc
 import machine
 import micropython
-from dotenv import load_dotenv
-import os
+profiler.lap('import builtins')
+import UpyIrTx
+profiler.lap('import UpyIrTx')
+from record_data import IrSignalRecorder
+profiler.lap('import record_data')
+from esp32_wifi_server import WiFiConfig, ESP32Server, EventStream
+profiler.lap('import esp32_wifi_server')
+from sensor import DS18X20Sensor, TemperatureMonitor
+from thermostat import Thermostat
+profiler.lap('import thermostat')
+from journal import EventJournal, HttpSink
+profiler.lap('import journal')
+from emitter import IrEmitter, fire_concurrently
+from device_state import DeviceState
+from adaptive_tx import AdaptiveTransmitter, LoopbackListener, send_group
+profiler.lap('import emitter')
 
-# 環境変数を読み込む
-load_dotenv()
+def get_config(name, default=None):
+    """
+    設定値を取得する
+    build_mpy.pyで.envから生成したconfigモジュールを優先し、無い場合は.envを読み込む
+    """
+    global _config
+    if _config is None:
+        try:
+            import config
+            _config = config.__dict__
+        except ImportError:
+            # 開発用（dotenvはMicroPythonに通常含まれないため、必要な時だけ読み込む）
+            from dotenv import load_dotenv
+            import os
+            load_dotenv()
+            _config = os.environ
+    value = _config.get(name)
+    return default if value is None else value
+
+_config = None
 
 def print_system_stats():
     """システムのリソース使用状況を表示"""
@@ -29,15 +58,78 @@ def print_system_stats():
     print("==============================\n")
 
 class AirConditionerController:
-    def __init__(self, ir_tx_pin, ir_rx_pin, signal_led_pin=32):
-        # 信号の受信と送信用
-        self.signal_recorder = IrSignalRecorder(ir_rx_pin)
-        # 信号の送信用ピンを設定
-        self.ir_tx = UpyIrTx.UpyIrTx(0, Pin(ir_tx_pin, Pin.OUT))
+    # 既定の送信機の名前
+    DEFAULT_EMITTER = 'main'
+    # 送信後、受信途中の自分の信号を捨てる時間
+    ECHO_SETTLE_MS = 200
+    
+    def __init__(self, ir_tx_pin, ir_rx_pin, signal_led_pin=32, journal=None, lazy=False, adaptive=True, tx_gap_ms=1100):
+        # 受信機の初期化と信号の読み込みを最初に使う時まで遅らせるか
+        self.lazy = lazy
+        # 送信した信号を受信機で確認して欠けていれば再送し、送信後の固定の待ち時間を次の送信の前に回すか
+        self.adaptive = adaptive
+        # 適応的な送信で、前の送信から次の送信までに空ける間隔（エアコンが受け付けられる間隔）
+        self.tx_gap_ms = tx_gap_ms
+        # 信号の受信と送信用（受信機は全ての送信機で共有）
+        self.signal_recorder = IrSignalRecorder(ir_rx_pin, lazy=lazy)
+        # 送信機（名前 -> IrEmitter）とグループ（名前 -> 送信機名のリスト）
+        self.emitters = {}
+        self.groups = {}
+        # 送信機ごとの適応的な送信（名前 -> AdaptiveTransmitter）
+        self.transmitters = {}
+        # 既定の送信機はRMTチャンネル0
+        self.add_emitter(self.DEFAULT_EMITTER, 0, ir_tx_pin, recorder=self.signal_recorder)
         # 信号送信用LED
         self.signal_led = Pin(signal_led_pin, Pin.OUT)
+        # イベントジャーナル（Noneの場合は記録しない）
+        self.journal = journal
+        # 送信機ごとに最後に把握したエアコンの状態 (power_on, mode, temperature, fan_speed)
+        self.states = DeviceState()
+    
+    def add_emitter(self, name, channel, tx_pin, base_dir=None, recorder=None):
+        """
+        送信機を追加する
+        
+        Args:
+            name (str): 送信機の名前
+            channel (int): RMTチャンネル（送信機ごとに別のチャンネルを使う）
+            tx_pin (int): 送信ピン
+            base_dir (str): 信号の保存先（省略時は "signals_<name>"）
+            recorder (IrSignalRecorder): 既存の信号ライブラリを使う場合に指定
+        """
+        if recorder is None:
+            recorder = IrSignalRecorder(None, base_dir=base_dir or "signals_" + name, lazy=True)
+            recorder.share_receiver(self.signal_recorder)
+            if not self.lazy:
+                recorder.load()
+        ir_tx = UpyIrTx.UpyIrTx(channel, Pin(tx_pin, Pin.OUT))
+        self.emitters[name] = IrEmitter(name, ir_tx, recorder, channel, tx_pin)
+        self.transmitters[name] = AdaptiveTransmitter(self.emitters[name], LoopbackListener(self.signal_recorder),
+                                                   gap_ms=self.tx_gap_ms)
+        self.groups['all'] = list(self.emitters)
+    
+    def add_group(self, name, emitter_names):
+        """複数の送信機をまとめたグループを追加"""
+        for emitter_name in emitter_names:
+            if emitter_name not in self.emitters:
+                raise ValueError(f"不明な送信機: {emitter_name}")
+        self.groups[name] = list(emitter_names)
+    
+    def resolve(self, unit=None):
+        """送信機名またはグループ名から送信機のリストを取得"""
+        if not unit:
+            return [self.emitters[self.DEFAULT_EMITTER]]
+        if unit in self.emitters:
+            return [self.emitters[unit]]
+        if unit in self.groups:
+            return [self.emitters[name] for name in self.groups[unit]]
+        raise ValueError(f"不明な送信機: {unit}")
     
-    def control(self, power_on: bool, mode: str, temperature: int, fan_speed: int):
+    def controls_default(self, unit=None):
+        """送信機名またはグループ名が既定の送信機を含むかどうか"""
+        return self.emitters[self.DEFAULT_EMITTER] in self.resolve(unit)
+    
+    def control(self, power_on: bool, mode: str, temperature: int, fan_speed: int, unit=None, source='api'):
         """
         エアコンの制御を行う
         
@@ -46,40 +138,114 @@ class AirConditionerController:
             mode (str): モード（"cool": 冷房, "heat": 暖房）
             temperature (int): 温度
             fan_speed (int): 風の強さ
+            unit (str): 送信機名またはグループ名（省略時は既定の送信機）
+            source (str): 操作元（"api", "thermostat" など）
+        """
+        emitters = self.resolve(unit)
+        start = time.ticks_ms()
+        success = self._control(emitters, power_on, mode, temperature, fan_speed, source)
+        self.journal_call('log_control', power_on, mode, temperature, fan_speed, success,
+                          time.ticks_diff(time.ticks_ms(), start))
+        return success
+    
+    def journal_call(self, name, *args):
+        """
+        ジャーナルのメソッドを呼び出す
+        フラッシュの空きが無いなどで記録に失敗しても、制御やサーバーの処理は止めない
         """
-        # 信号データベースから条件に合う信号を検索
-        signals = self.signal_recorder.search_signals(
-            power_on=power_on,
-            mode=mode,
-            temperature=temperature,
-            fan_speed=fan_speed
-        )
+        if self.journal is None:
+            return None
+        try:
+            return getattr(self.journal, name)(*args)
+        except Exception as e:
+            print(f"ジャーナル記録エラー: {e}")
+            return None
+    
+    def _control(self, emitters, power_on, mode, temperature, fan_speed, source):
+        """信号を検索して送信"""
+        jobs = []
+        for emitter in emitters:
+            # 送信機ごとの信号データベースから条件に合う信号を検索
+            signals = emitter.recorder.search_signals(
+                power_on=power_on,
+                mode=mode,
+                temperature=temperature,
+                fan_speed=fan_speed
+            )
+            
+            # signalsがNoneまたは空のリストの場合
+            if signals is None or not signals:
+                print(f"エラー: 条件に合う信号が見つかりません ({emitter.name})")
+                print(f"power_on: {power_on}, mode: {mode}, temperature: {temperature}, fan_speed: {fan_speed}")
+                return False
+            jobs.append((emitter, signals["signal_data"]))
         print("信号を取得")
         
-        # signalsがNoneまたは空のリストの場合
-        if signals is None or not signals:
-            print(f"エラー: 条件に合う信号が見つかりません")
-            print(f"power_on: {power_on}, mode: {mode}, temperature: {temperature}, fan_speed: {fan_speed}")
-            return False
-        
-        # 最初に見つかった信号を使用
-        signal_data = signals["signal_data"]
-        
         # 信号を送信
         try:
             # LEDを点滅
             self.signal_led.value(1)  # LEDを点灯
-            for _ in range(1):
-                self.ir_tx.send(signal_data)
+            if not self.adaptive:
+                # 全ての送信機から同時に送信し、待ち時間は1回だけにする
+                results = fire_concurrently(jobs)
                 time.sleep(1)
-            time.sleep(0.1)  # 少し待つ
+                time.sleep(0.1)  # 少し待つ
+            elif len(jobs) == 1:
+                # ループバックで確認し、欠けていた場合だけ再送する
+                emitter, signal_data = jobs[0]
+                transmitter = self.transmitters[emitter.name]
+                results = [transmitter.send(signal_data)]
+                print(f"送信回数: {transmitter.last_attempts} ({transmitter.last_latency_ms}ms)")
+            else:
+                # 同時に送信した信号は受信機で重なるため確認せず、送信間隔だけ守る
+                results = send_group(self.transmitters, jobs)
+            # 受信機に届いた自分の信号を、リモコン操作として検出しないように捨てる
+            self.signal_recorder.clear_pending(self.ECHO_SETTLE_MS)
             self.signal_led.value(0)  # LEDを消灯
-            return True
+            for (emitter, _), sent in zip(jobs, results):
+                if sent:
+                    self.states.update(emitter.name, (power_on, mode, temperature, fan_speed), source)
+            return all(results)
         except Exception as e:
             print(f"信号送信エラー: {e}")
+            self.journal_call('log_error', f"send: {e}")
             return False
     
-    def learn_signal(self, power_on: bool, mode: str, temperature: int, fan_speed: int):
+    def sniff_remote(self, wait_ms=50):
+        """
+        純正リモコンの操作を検出して状態を更新する
+        受信機は別スレッドで常に待ち受けているため、ここでは届いていた信号を照合するだけで待たない
+        （スレッドが使えない場合のみ、wait_msまで待ち受ける）
+        
+        Returns:
+            tuple: 最後に検出した (送信機名, 状態)。検出しなかった場合はNone
+        """
+        recorder = self.signal_recorder
+        if not recorder.start_listening():
+            return self._match_remote(recorder.capture(wait_ms))
+        detected = None
+        while True:
+            pulses = recorder.capture(0)
+            if not pulses:
+                return detected
+            detected = self._match_remote(pulses) or detected
+    
+    def _match_remote(self, pulses):
+        """受信した信号を各送信機の信号ライブラリと照合し、最初に一致したものを採用"""
+        if not pulses:
+            return None
+        for emitter in self.emitters.values():
+            key = emitter.recorder.fingerprint_index.match(pulses)
+            if key is None:
+                continue
+            if not self.states.update(emitter.name, key, 'remote'):
+                return None
+            print(f"リモコン操作を検出 ({emitter.name}): {key}")
+            return emitter.name, key
+        print("未登録の信号を受信しました")
+        return None
+    
+    def learn_signal(self, power_on: bool, mode: str, temperature: int, fan_speed: int, unit=None):
         """
         エアコンの信号を学習する
         
@@ -88,13 +254,25 @@ class AirConditionerController:
             mode (str): モード（"cool": 冷房, "heat": 暖房）
             temperature (int): 温度
             fan_speed (int): 風の強さ
+            unit (str): 学習した信号を保存する送信機名（省略時は既定の送信機）
             
         Returns:
             bool: 学習が成功したかどうか
         """
+        emitters = self.resolve(unit)
+        if len(emitters) != 1:
+            raise ValueError("信号の学習は送信機1台ずつ行ってください")
+        start = time.ticks_ms()
+        success = self._learn_signal(emitters[0].recorder, power_on, mode, temperature, fan_speed)
+        self.journal_call('log_learn', power_on, mode, temperature, fan_speed, success,
+                          time.ticks_diff(time.ticks_ms(), start))
+        return success
+    
+    def _learn_signal(self, recorder, power_on, mode, temperature, fan_speed):
+        """信号を受信して保存"""
         try:
             # 信号を記録
-            success, message = self.signal_recorder.record_signal(
+            success, message = recorder.record_signal(
                 power_on=power_on,
                 mode=mode,
                 temperature=temperature,
@@ -114,12 +292,38 @@ class AirConditionerController:
                 
         except Exception as e:
             print(f"信号学習エラー: {e}")
+            self.journal_call('log_error', f"learn: {e}")
             return False
 
+def _required_mode(params):
+    """モードのパラメータを取得（"cool"または"heat"以外はValueError）"""
+    mode = params.get('mode', '')
+    if mode not in ('cool', 'heat'):
+        raise ValueError(f"不明なモード: {mode}")
+    return mode
+
+def _required_int(params, name):
+    """必須の整数パラメータを取得（無い場合は0とみなさずValueError）"""
+    value = params.get(name)
+    if not value:
+        raise ValueError(f"{name}が指定されていません")
+    return int(value)
+
 class AirConditionerServer(ESP32Server):
-    def __init__(self, wifi_config, controller, port=80, led_connected_pin=22, led_disconnected_pin=23):
-        super().__init__(wifi_config, port, led_connected_pin, led_disconnected_pin)
+    def __init__(self, wifi_config, controller, port=80, led_connected_pin=22, led_disconnected_pin=23,
+                 monitor=None, thermostat=None, sniff_remote=True, listen_first=False, profiler=None,
+                 cors_max_age=7200):
+        super().__init__(wifi_config, port, led_connected_pin, led_disconnected_pin,
+                         listen_first=listen_first, profiler=profiler, cors_max_age=cors_max_age)
         self.controller = controller
+        # 室温モニターとサーモスタット（センサー未接続の場合はNone）
+        self.monitor = monitor
+        self.thermostat = thermostat
+        # 待機中に純正リモコンの信号を監視するか
+        self.sniff_remote = sniff_remote
+        # 状態の変化を配信するストリーム
+        self.events = EventStream()
+        self.controller.states.listeners.append(self._publish_state)
         self._setup_aircon_routes()
         self._last_stats_time = time.ticks_ms()
         self._stats_interval = 5000  # 5秒ごとに統計を表示
@@ -134,8 +338,38 @@ class AirConditionerServer(ESP32Server):
     def _setup_aircon_routes(self):
         """エアコン制御用のルートを設定"""
         self.add_route('/aircon/control', self.handle_aircon_control)
-        self.add_route('/aircon/status', self.handle_aircon_status)
+        self.add_route('/aircon/status', self.handle_aircon_status, methods=('GET',), headers=('If-None-Match',))
         self.add_route('/aircon/learn', self.handle_aircon_learn)
+        self.add_route('/aircon/temperature', self.handle_aircon_temperature)
+        self.add_route('/aircon/thermostat', self.handle_aircon_thermostat)
+        self.add_route('/aircon/transmit', self.handle_aircon_transmit, methods=('GET',))
+        self.add_stream_route('/aircon/events', self.handle_aircon_events)
+    
+    def _publish_state(self, states):
+        """状態が変わった時に購読者へ配信"""
+        self.events.publish('state', states.to_json())
+    
+    def on_idle(self):
+        """リモコン操作の検出、室温のサンプリング、サーモスタットの更新、ジャーナルのアップロード、配信の維持"""
+        if self.sniff_remote:
+            detected = self.controller.sniff_remote()
+            if detected is not None and self.thermostat is not None:
+                name, key = detected
+                # サーモスタットは既定の送信機を制御している
+                if name == self.controller.DEFAULT_EMITTER:
+                    self.thermostat.sync(*key)
+        if self.monitor is not None:
+            try:
+                temperature = self.monitor.poll()
+                if temperature is not None:
+                    self.controller.journal_call('log_sensor', temperature)
+                    if self.thermostat is not None:
+                        self.thermostat.update()
+            except Exception as e:
+                print(f"サーモスタット更新エラー: {e}")
+        # アップロードは別スレッドで行われるため、ここで待たされることはない
+        self.controller.journal_call('maybe_upload')
+        self.events.keepalive()
     
     def handle_aircon_control(self, params):
         """エアコン制御リクエストを処理"""
@@ -143,15 +377,18 @@ class AirConditionerServer(ESP32Server):
         try:
             # パラメータの取得とバリデーション
             power_on = params.get('power_on', '').lower() == 'true'
-            mode = params.get('mode', '')
-            temperature = int(params.get('temperature', 0))
-            fan_speed = int(params.get('fan_speed', 0))
+            mode = _required_mode(params)
+            temperature = _required_int(params, 'temperature')
+            fan_speed = _required_int(params, 'fan_speed')
+            # 送信機名またはグループ名（省略時は既定の送信機）
+            unit = params.get('unit') or None
             
             print("\n=== エアコン制御リクエスト ===")
             print(f"電源: {'ON' if power_on else 'OFF'}")
             print(f"モード: {mode}")
             print(f"温度: {temperature}度")
             print(f"風量: {fan_speed}")
+            print(f"送信機: {unit or self.controller.DEFAULT_EMITTER}")
             print("==========================\n")
             
             # エアコンを制御
@@ -159,39 +396,64 @@ class AirConditionerServer(ESP32Server):
                 power_on=power_on,
                 mode=mode,
                 temperature=temperature,
-                fan_speed=fan_speed
+                fan_speed=fan_speed,
+                unit=unit
             )
             
             if success:
+                # サーモスタットは既定の送信機を制御している（グループでの送信を含む）
+                if self.thermostat is not None and self.controller.controls_default(unit):
+                    self.thermostat.sync(power_on, mode, temperature, fan_speed)
                 return {'status': 'success', 'message': 'OK'}, 200
             else:
                 return {'status': 'error', 'message': 'Control failed'}, 500
                 
+        except ValueError as e:
+            print(f"エラー: {e}")
+            return {'status': 'error', 'message': 'Invalid parameter'}, 400
         except Exception as e:
             print(f"エラー: {e}")
             return {'status': 'error', 'message': 'Internal error'}, 500
     
     def handle_aircon_status(self, params):
-        """エアコンの状態を取得"""
-        print("\n=== 状態確認リクエスト ===")
-        print("システムの状態を確認します")
-        print("==========================\n")
-        return {'status': 'success', 'message': 'OK'}, 200
+        """
+        エアコンの状態を取得
+        ETagを付けて返すため、If-None-Matchが一致すれば304（本文なし）で応答される
+        """
+        states = self.controller.states
+        return states.to_json(), 200, {'ETag': states.etag(), 'Cache-Control': 'no-cache'}
+    
+    def handle_aircon_transmit(self, params):
+        """送信機ごとの送信の統計（送信回数・再送回数・遅延の中央値など）を取得"""
+        transmitters = self.controller.transmitters
+        return {
+            'status': 'success',
+            'adaptive': self.controller.adaptive,
+            'transmitters': {name: t.stats() for name, t in transmitters.items()},
+        }, 200
+    
+    def handle_aircon_events(self, client_socket, request):
+        """状態の変化をServer-Sent Eventsで配信（接続直後に現在の状態を送る）"""
+        if not self.events.subscribe(client_socket, 'state', self.controller.states.to_json()):
+            client_socket.send(self._build_response(503, '{"status":"error","message":"Too many subscribers"}'))
+            client_socket.close()
     
     def handle_aircon_learn(self, params):
         """エアコンの信号を学習"""
         try:
             # パラメータの取得とバリデーション
             power_on = params.get('power_on', '').lower() == 'true'
-            mode = params.get('mode', '')
-            temperature = int(params.get('temperature', 0))
-            fan_speed = int(params.get('fan_speed', 0))
+            mode = _required_mode(params)
+            temperature = _required_int(params, 'temperature')
+            fan_speed = _required_int(params, 'fan_speed')
+            unit = params.get('unit') or None
             
             print("\n=== 信号学習リクエスト ===")
             print(f"電源: {'ON' if power_on else 'OFF'}")
             print(f"モード: {mode}")
             print(f"温度: {temperature}度")
             print(f"風量: {fan_speed}")
+            print(f"送信機: {unit or self.controller.DEFAULT_EMITTER}")
             print("信号の受信を待機します...")
             print("==========================\n")
             
@@ -200,7 +462,8 @@ class AirConditionerServer(ESP32Server):
                 power_on=power_on,
                 mode=mode,
                 temperature=temperature,
-                fan_speed=fan_speed
+                fan_speed=fan_speed,
+                unit=unit
             )
             
             if success:
@@ -208,41 +471,132 @@ class AirConditionerServer(ESP32Server):
             else:
                 return {'status': 'error', 'message': 'Learn failed'}, 500
                 
+        except ValueError as e:
+            print(f"エラー: {e}")
+            return {'status': 'error', 'message': 'Invalid parameter'}, 400
         except Exception as e:
             print(f"エラー: {e}")
             return {'status': 'error', 'message': 'Internal error'}, 500
 
-# 使用例
-if __name__ == "__main__":
+    def handle_aircon_temperature(self, params):
+        """室温の履歴を取得（resolution: raw / 1m / 15m）"""
+        if self.monitor is None:
+            return {'status': 'error', 'message': 'Sensor not available'}, 404
+        try:
+            resolution = params.get('resolution', 'raw')
+            limit = int(params['limit']) if 'limit' in params else None
+            series = self.monitor.history.series(resolution, limit)
+            if series is None:
+                return {'status': 'error', 'message': 'Unknown resolution'}, 400
+            return {
+                'status': 'success',
+                'current': self.monitor.current(),
+                'resolution': resolution,
+                'series': series
+            }, 200
+        except Exception as e:
+            print(f"エラー: {e}")
+            return {'status': 'error', 'message': 'Internal error'}, 500
+    
+    def handle_aircon_thermostat(self, params):
+        """サーモスタットの設定を変更・取得"""
+        if self.thermostat is None:
+            return {'status': 'error', 'message': 'Thermostat not available'}, 404
+        try:
+            # パラメータが無い場合は取得のみ（ポーリングで制御の状態を変えない）
+            if params:
+                enabled = params.get('enabled')
+                self.thermostat.configure(
+                    enabled=None if enabled is None else enabled.lower() == 'true',
+                    target=float(params['target']) if 'target' in params else None,
+                    mode=params.get('mode'),
+                    fan_speed=int(params['fan_speed']) if 'fan_speed' in params else None,
+                    control=params.get('control')
+                )
+            return {'status': 'success', 'thermostat': self.thermostat.status()}, 200
+        except ValueError as e:
+            print(f"エラー: {e}")
+            return {'status': 'error', 'message': 'Invalid parameter'}, 400
+        except Exception as e:
+            print(f"エラー: {e}")
+            return {'status': 'error', 'message': 'Internal error'}, 500
+
+def run(fast_boot=None):
+    """
+    エアコン制御サーバーを起動する
+    
+    Args:
+        fast_boot (bool): Trueの場合、ソケットを先に開き、信号の読み込みなどは最初に使う時まで遅らせる
+                          （省略時は設定のFAST_BOOTに従う）
+    """
+    if fast_boot is None:
+        fast_boot = str(get_config("FAST_BOOT", "true")).lower() == "true"
+    
     # ピン番号の設定
     IR_TX_PIN = 13
     IR_RX_PIN = 14
     LED_CONNECTED_PIN = 21
     LED_DISCONNECTED_PIN = 23
     SIGNAL_LED_PIN = 32
+    TEMP_SENSOR_PIN = 4
+    
+    # イベントジャーナル（送信先が設定されていない場合はフラッシュに保持するのみ）
+    journal_host = get_config("JOURNAL_HOST")
+    journal = EventJournal(
+        HttpSink(journal_host, int(get_config("JOURNAL_PORT", "80"))) if journal_host else None
+    )
+    profiler.lap('journal init')
     
     # コントローラーの作成
     controller = AirConditionerController(
         IR_TX_PIN, 
         IR_RX_PIN,
-        signal_led_pin=SIGNAL_LED_PIN
+        signal_led_pin=SIGNAL_LED_PIN,
+        journal=journal,
+        lazy=fast_boot,
+        adaptive=str(get_config("ADAPTIVE_TX", "true")).lower() == "true",
+        tx_gap_ms=int(get_config("TX_GAP_MS", "1100"))
     )
+    # 2台目以降のエアコンは別のRMTチャンネルとピンで送信機を追加する
+    # controller.add_emitter('bedroom', 1, 12)
+    # controller.add_group('upstairs', ['main', 'bedroom'])
+    profiler.lap('recorder init')
+    
+    # 室温センサーとサーモスタット（センサーが無い場合は無効）
+    try:
+        monitor = TemperatureMonitor(DS18X20Sensor(TEMP_SENSOR_PIN))
+        thermostat = Thermostat(controller, monitor)
+    except Exception as e:
+        print(f"温度センサー初期化エラー: {e}")
+        monitor = None
+        thermostat = None
+    profiler.lap('sensor init')
     
     # WiFi設定
     wifi_config = WiFiConfig(
-        ssid=os.getenv("WIFI_SSID", "ssid"),
-        password=os.getenv("WIFI_PASSWORD", "pass"),
-        static_ip=os.getenv("WIFI_STATIC_IP", "ip"),
-        subnet_mask=os.getenv("WIFI_SUBNET_MASK", "255.255.255.0"),
-        gateway=os.getenv("WIFI_GATEWAY", "gateway"),
-        dns=os.getenv("WIFI_DNS", "8.8.8.8")
+        ssid=get_config("WIFI_SSID", "ssid"),
+        password=get_config("WIFI_PASSWORD", "pass"),
+        static_ip=get_config("WIFI_STATIC_IP", "ip"),
+        subnet_mask=get_config("WIFI_SUBNET_MASK", "255.255.255.0"),
+        gateway=get_config("WIFI_GATEWAY", "gateway"),
+        dns=get_config("WIFI_DNS", "8.8.8.8")
     )
+    profiler.lap('config')
     # サーバーの作成と開始
     server = AirConditionerServer(
        wifi_config, 
        controller,
        led_connected_pin=LED_CONNECTED_PIN,
-       led_disconnected_pin=LED_DISCONNECTED_PIN
+       led_disconnected_pin=LED_DISCONNECTED_PIN,
+       monitor=monitor,
+       thermostat=thermostat,
+       listen_first=fast_boot,
+       profiler=profiler,
+       cors_max_age=int(get_config("CORS_MAX_AGE", "7200"))
     )
 
     server.start()
+
+# 使用例
+if __name__ == "__main__":
+    run()
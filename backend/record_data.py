@@ -3,14 +3,207 @@ import utime
 import uos
 from UpyIrRx import UpyIrRx
 from machine import Pin
-import random
+try:
+    import _thread
+except ImportError:
+    _thread = None
+from fingerprint import FingerprintIndex
+from ticks import ticks_ms, ticks_diff, ticks_add, sleep_ms
+from signal_model import SignalModel
+
+# モデルをまだ用意していないことを表す（推定できなかった場合のNoneと区別する）
+_MODEL_UNSET = object()
 
 class IrSignalRecorder:
-    def __init__(self, ir_pin_num):
-        self.ir_rx = UpyIrRx(Pin(ir_pin_num))
-        self.base_dir = "signals"
+    # 常時受信で溜めておく信号の上限（超えた場合は古いものから捨てる）
+    MAX_PENDING = 4
+    
+    def __init__(self, ir_pin_num, base_dir="signals", lazy=False):
+        """
+        Args:
+            ir_pin_num (int): 赤外線受信ピン
+            base_dir (str): 信号の保存先
+            lazy (bool): Trueの場合、受信機の初期化と信号の読み込みを最初に使う時まで遅らせる
+        """
+        self.ir_pin_num = ir_pin_num
+        self.base_dir = base_dir
+        self._ir_rx = None
+        self._rx_owner = None
+        self._all_signals = None
+        self._fingerprint_index = None
+        self._signal_model = _MODEL_UNSET
+        # 学習後はmodel.jsonが古いため、学習済みの信号から推定し直す
+        self._model_stale = False
+        # 常時受信（別スレッドで受信したパルス列のキュー）
+        self._listening = False
+        self._pending = []
+        self._pending_lock = None
+        self._ignore_until = None   # この時刻までに受信し終えた信号は捨てる（自分で送信した信号）
+        if not lazy:
+            self.load()
+    
+    def load(self):
+        """受信機を初期化して信号を読み込む（lazy=Trueの場合は最初に使う時に行われる）"""
+        self._open_receiver()
+        self._load()
+    
+    def _open_receiver(self):
+        """受信機を初期化（他の信号ライブラリと共有している場合はそちらの受信機を使う）"""
+        if self._rx_owner is not None:
+            return self._rx_owner.ir_rx
+        if self._ir_rx is None:
+            self._ir_rx = UpyIrRx(Pin(self.ir_pin_num))
+        return self._ir_rx
+    
+    @property
+    def ir_rx(self):
+        """受信機（最初に使う時に初期化）"""
+        return self._open_receiver()
+    
+    def share_receiver(self, owner):
+        """他の信号ライブラリと受信機を共有する"""
+        self._rx_owner = owner
+    
+    @property
+    def listening(self):
+        """受信機を常に待ち受け状態にしているかどうか"""
+        if self._rx_owner is not None:
+            return self._rx_owner.listening
+        return self._listening
+    
+    def start_listening(self, wait_ms=1000):
+        """
+        受信機を常に待ち受け状態にするスレッドを開始する
+        受信したパルス列はキューに溜め、capture()で取り出す（待ち受けの合間や途中から受信して取りこぼすことがない）
+        
+        Args:
+            wait_ms (int): 1回の待ち受け時間（受信が無ければ待ち受けをやり直す）
+            
+        Returns:
+            bool: 常時受信を開始した（開始済みを含む）場合はTrue。スレッドが使えない場合はFalse
+        """
+        if self._rx_owner is not None:
+            return self._rx_owner.start_listening(wait_ms)
+        if self._listening:
+            return True
+        if _thread is None:
+            return False
+        self._pending_lock = _thread.allocate_lock()
+        self._listening = True
+        _thread.start_new_thread(self._listen_loop, (self.ir_rx, wait_ms))
+        return True
+    
+    def stop_listening(self):
+        """常時受信を停止する（待ち受け中の受信が終わり次第スレッドが終了する）"""
+        if self._rx_owner is not None:
+            self._rx_owner.stop_listening()
+            return
+        self._listening = False
+    
+    def _listen_loop(self, ir_rx, wait_ms):
+        """受信スレッド: 受信が終わるとすぐに次の待ち受けを始める"""
+        while self._listening:
+            try:
+                if ir_rx.record(wait_ms) != 0:
+                    continue
+                pulses = ir_rx.get_calibrate_list()
+            except Exception as e:
+                print(f"信号受信エラー: {e}")
+                sleep_ms(100)
+                continue
+            if not pulses:
+                continue
+            ignore_until = self._ignore_until
+            if ignore_until is not None and ticks_diff(ignore_until, ticks_ms()) > 0:
+                continue
+            with self._pending_lock:
+                self._pending.append(pulses)
+                if len(self._pending) > self.MAX_PENDING:
+                    self._pending.pop(0)
+    
+    def clear_pending(self, settle_ms=0):
+        """
+        常時受信で溜まっている信号を捨てる
+        
+        Args:
+            settle_ms (int): 送信直後に呼ぶ場合、受信途中の自分の信号も捨てるために、この時間内に受信し終えた信号も捨てる
+        """
+        if self._rx_owner is not None:
+            self._rx_owner.clear_pending(settle_ms)
+            return
+        if self._pending_lock is None:
+            return
+        with self._pending_lock:
+            self._pending = []
+        self._ignore_until = ticks_add(ticks_ms(), settle_ms) if settle_ms else None
+    
+    def _next_pending(self, wait_ms):
+        """溜まっている信号を1つ取り出す（wait_msまで待つ。Noneの場合は届くまで待つ）"""
+        start = ticks_ms()
+        while True:
+            with self._pending_lock:
+                if self._pending:
+                    return self._pending.pop(0)
+            if wait_ms is not None and ticks_diff(ticks_ms(), start) >= wait_ms:
+                return None
+            sleep_ms(5)
+    
+    @property
+    def loaded(self):
+        """信号を読み込み済みかどうか"""
+        return self._all_signals is not None
+    
+    @property
+    def all_signals(self):
+        """全ての信号（最初に使う時に読み込む）"""
+        if self._all_signals is None:
+            self._load()
+        return self._all_signals
+    
+    @property
+    def fingerprint_index(self):
+        """純正リモコンの操作を識別するための索引"""
+        if self._fingerprint_index is None:
+            self._load()
+        return self._fingerprint_index
+    
+    @property
+    def signal_model(self):
+        """
+        信号を合成するためのモデル（推定できない場合はNone）
+        model.jsonがあれば読み込み、無ければ学習済みの信号から推定する
+        推定できなかった結果も保持し、信号が見つからないたびに推定し直さない
+        """
+        if self._signal_model is _MODEL_UNSET:
+            self._signal_model = None
+            if not self._model_stale:
+                try:
+                    with open(self.base_dir + "/model.json", 'r') as f:
+                        self._signal_model = SignalModel.from_dict(ujson.load(f))
+                    return self._signal_model
+                except OSError:
+                    pass
+            else:
+                print("信号を学習したため、model.jsonではなく学習済みの信号からモデルを推定します")
+            self._signal_model = SignalModel.build(self.all_signals)
+        return self._signal_model
+    
+    def synthesize_signal(self, power_on, mode, temperature, fan_speed):
+        """学習していない組み合わせの信号をモデルから合成"""
+        try:
+            model = self.signal_model
+            if model is None:
+                return None
+            return model.synthesize(power_on, mode, temperature, fan_speed)
+        except Exception as e:
+            print(f"信号合成エラー: {e}")
+            return None
+    
+    def _load(self):
+        """ディレクトリを確保して信号を読み込む"""
         self._ensure_directory_structure()
-        self.all_signals = self._load_all_signals()
+        self._all_signals = self._load_all_signals()
+        self._fingerprint_index = FingerprintIndex(self._all_signals)
     
     def _ensure_directory_structure(self):
         """ディレクトリ構造を確保"""
@@ -43,15 +236,23 @@ class IrSignalRecorder:
             fan_speed
         )
     
+    def _all_signals_pattern(self):
+        """全ての信号ファイルに一致するパターン（_match_patternはパーツ単位のワイルドカードのみ対応）"""
+        return self.base_dir + "/power_on/*/*/*/*"
+    
     def record_signal(self, power_on, mode, temperature, fan_speed):
         """信号を記録"""
         try:
             print("信号を受信待機中...")
-            error = self.ir_rx.record()
-            if error != 0:
-                return False, f"信号受信エラー: {error}"
-            
-            signal_list = self.ir_rx.get_calibrate_list()
+            if self.listening:
+                # 常時受信中は受信機を直接使わず、これから届く信号を使う
+                self.clear_pending()
+                signal_list = self.capture(None)
+            else:
+                error = self.ir_rx.record()
+                if error != 0:
+                    return False, f"信号受信エラー: {error}"
+                signal_list = self.ir_rx.get_calibrate_list()
             if not signal_list:
                 return False, "信号データが取得できませんでした"
             
@@ -72,14 +273,22 @@ class IrSignalRecorder:
                 print(f"ディレクトリ作成エラー: {e}")
             
             # 信号データを保存
+            signal = {
+                "power_on": power_on,
+                "mode": mode,
+                "temperature": temperature,
+                "fan_speed": fan_speed,
+                "signal_data": signal_list
+            }
             with open(file_path, 'w') as f:
-                ujson.dump({
-                    "power_on": power_on,
-                    "mode": mode,
-                    "temperature": temperature,
-                    "fan_speed": fan_speed,
-                    "signal_data": signal_list
-                }, f)
+                ujson.dump(signal, f)
+            # 読み込み前であれば、次に読み込む時に含まれる
+            if self.loaded:
+                self._all_signals.append(signal)
+                self._fingerprint_index.add(signal)
+            # 新しい信号を含めてモデルを推定し直す（model.jsonは学習前のものなので使わない）
+            self._signal_model = _MODEL_UNSET
+            self._model_stale = True
             
             print(f"信号を保存しました: {file_path}")
             return True, f"信号を保存しました: {file_path}"
@@ -88,8 +297,31 @@ class IrSignalRecorder:
             print(f"信号保存エラー: {e}")
             return False, f"信号保存エラー: {e}"
     
+    def capture(self, wait_ms=50):
+        """
+        信号を待ち受ける（受信待ちはwait_msまで）
+        常時受信中は、受信スレッドが溜めた信号を取り出す（wait_msがNoneの場合は届くまで待つ）
+        
+        Returns:
+            list: 受信したパルス列。受信できなかった場合はNone
+        """
+        if self._rx_owner is not None:
+            return self._rx_owner.capture(wait_ms)
+        if self._listening:
+            return self._next_pending(wait_ms)
+        try:
+            if self.ir_rx.record(wait_ms) != 0:
+                return None
+            return self.ir_rx.get_calibrate_list() or None
+        except Exception as e:
+            print(f"信号受信エラー: {e}")
+            return None
+    
     def search_signals(self, power_on=None, mode=None, temperature=None, fan_speed=None):
-        """条件に合う信号を検索（優先度: power_on > mode > temperature > fan_speed）"""
+        """
+        条件に合う信号を検索（Noneの項目は全てに一致）
+        全て指定して学習済みの信号が無い場合はモデルから合成し、合成できなければNone（近い信号で代用しない）
+        """
         try:
             # 検索パターンを生成
             power_pattern = "*" if power_on is None else ("true" if power_on else "false")
@@ -113,41 +345,20 @@ class IrSignalRecorder:
                     signal_data = ujson.load(f)
                     signals.append(signal_data)
             
+            if not signals and None not in (power_on, mode, temperature, fan_speed):
+                # 学習していない組み合わせはモデルから合成する
+                synthesized = self.synthesize_signal(power_on, mode, temperature, fan_speed)
+                if synthesized is not None:
+                    print("学習済みの信号から合成しました")
+                    return synthesized
+            
             if not signals:
                 print(f"条件に合う信号が見つかりません")
                 print(f"power_on: {power_on}, mode: {mode}, temperature: {temperature}, fan_speed: {fan_speed}")
                 return None
             
-            # 優先度に基づいて信号をフィルタリング
-            filtered_signals = self.all_signals
-            
-            # 1. power_onでフィルタリング
-            if power_on is not None:
-                filtered_signals = [s for s in filtered_signals if s["power_on"] == power_on]
-                if not filtered_signals:
-                    filtered_signals = signals  # 一致するものがなければ元のリストに戻す
-            
-            # 2. modeでフィルタリング
-            if mode is not None:
-                temp_filtered = [s for s in filtered_signals if s["mode"] == mode]
-                if temp_filtered:
-                    filtered_signals = temp_filtered
-            
-            # 3. temperatureでフィルタリング
-            if temperature is not None:
-                temp_filtered = [s for s in filtered_signals if s["temperature"] == temperature]
-                if temp_filtered:
-                    filtered_signals = temp_filtered
-            
-            # 4. fan_speedでフィルタリング
-            if fan_speed is not None:
-                temp_filtered = [s for s in filtered_signals if s["fan_speed"] == fan_speed]
-                if temp_filtered:
-                    filtered_signals = temp_filtered
-            
-            # フィルタリングされた信号から1つをランダムに選択
-            selected_signal = random.choice(filtered_signals)
-            return selected_signal
+            # パスの各パーツが完全に一致したもの（全て指定した場合は1件のみ）
+            return signals[0]
             
         except Exception as e:
             print(f"信号検索エラー: {e}")
@@ -195,13 +406,12 @@ class IrSignalRecorder:
             if len(path_parts) != len(pattern_parts):
                 return False
             
-            # 各パーツを比較
+            # 各パーツを比較（部分一致ではなく完全一致。末尾の*は前方一致）
             for path_part, pattern_part in zip(path_parts, pattern_parts):
-                # ワイルドカードの場合はスキップ
-                if pattern_part == '*':
-                    continue
-                # パターンがパスに含まれていない場合は一致しない
-                if pattern_part not in path_part:
+                if pattern_part.endswith('*'):
+                    if not path_part.startswith(pattern_part[:-1]):
+                        return False
+                elif path_part != pattern_part:
                     return False
             
             return True
@@ -227,7 +437,7 @@ class IrSignalRecorder:
     def list_signals(self):
         """保存されている全ての信号をリスト表示"""
         try:
-            signal_files = self._find_files(self.base_dir + "/**/*.json")
+            signal_files = self._find_files(self._all_signals_pattern())
             
             if not signal_files:
                 print("保存されている信号はありません")
@@ -265,7 +475,7 @@ class IrSignalRecorder:
         try:
             signals = []
             # 全てのJSONファイルを検索
-            for file_path in self._find_files(self.base_dir + "/**/*.json"):
+            for file_path in self._find_files(self._all_signals_pattern()):
                 with open(file_path, 'r') as f:
                     signal_data = ujson.load(f)
                     signals.append(signal_data)
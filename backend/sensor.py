@@ -0,0 +1,218 @@
+"""
+室温センサーと時系列バッファ
+センサードライバは差し替え可能で、テストやシミュレーション用に SimulatedSensor を用意しています。
+記録は固定長のリングバッファに保存するため、長時間稼働してもメモリ使用量は一定です。
+"""
+from array import array
+import random
+import time
+
+
+class TemperatureSensor:
+    """温度センサードライバの基底クラス"""
+    def read(self):
+        """
+        温度を読み取る
+
+        Returns:
+            float: 温度（℃）。読み取れなかった場合はNone
+        """
+        raise NotImplementedError
+
+
+class DS18X20Sensor(TemperatureSensor):
+    """DS18B20（1-Wire）温度センサー"""
+    def __init__(self, pin_num):
+        # MicroPython専用モジュールのため、使用時のみ読み込む
+        import onewire
+        import ds18x20
+        from machine import Pin
+        self.ds = ds18x20.DS18X20(onewire.OneWire(Pin(pin_num)))
+        roms = self.ds.scan()
+        if not roms:
+            raise Exception('DS18X20センサーが見つかりません')
+        self.rom = roms[0]
+        # 変換には最大750msかかるため、前回開始した変換結果を読み取る
+        self.ds.convert_temp()
+
+    def read(self):
+        """前回の変換結果を読み取り、次の変換を開始"""
+        try:
+            temperature = self.ds.read_temp(self.rom)
+        except Exception as e:
+            print(f"センサー読み取りエラー: {e}")
+            temperature = None
+        self.ds.convert_temp()
+        return temperature
+
+
+class DHTSensor(TemperatureSensor):
+    """DHT11/DHT22温度センサー"""
+    def __init__(self, pin_num, model=22):
+        import dht
+        from machine import Pin
+        sensor_class = dht.DHT22 if model == 22 else dht.DHT11
+        self.dht = sensor_class(Pin(pin_num))
+
+    def read(self):
+        try:
+            self.dht.measure()
+            return self.dht.temperature()
+        except Exception as e:
+            print(f"センサー読み取りエラー: {e}")
+            return None
+
+
+class SimulatedSensor(TemperatureSensor):
+    """
+    室温のシミュレーション
+    外気温へ近づく熱の流入と、エアコンの設定温度へ近づく冷暖房を一次遅れで近似します。
+    """
+    def __init__(self, initial=28.0, outdoor=32.0, leak_rate=0.0005, aircon_rate=0.003, noise=0.05, seed=0):
+        self.temperature = initial
+        self.outdoor = outdoor
+        self.leak_rate = leak_rate          # 1秒あたりの外気温への追従率
+        self.aircon_rate = aircon_rate      # 1秒あたりの設定温度への追従率
+        self.noise = noise
+        self.random = random.Random(seed) if hasattr(random, 'Random') else random
+        self.power_on = False
+        self.mode = 'cool'
+        self.setpoint = 26
+
+    def apply_state(self, power_on, mode, temperature):
+        """エアコンの状態を反映"""
+        self.power_on = power_on
+        self.mode = mode
+        self.setpoint = temperature
+
+    def advance(self, seconds):
+        """シミュレーション時間を進める"""
+        for _ in range(int(seconds)):
+            self.temperature += (self.outdoor - self.temperature) * self.leak_rate
+            if self.power_on:
+                diff = self.setpoint - self.temperature
+                # 冷房は下げる方向、暖房は上げる方向にのみ働く
+                if (self.mode == 'cool' and diff < 0) or (self.mode == 'heat' and diff > 0):
+                    self.temperature += diff * self.aircon_rate
+
+    def read(self):
+        if not self.noise:
+            return self.temperature
+        return self.temperature + (self.random.random() * 2 - 1) * self.noise
+
+
+class RingBuffer:
+    """固定長の時系列リングバッファ（時刻は秒単位の整数）"""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array('l', [0] * capacity)
+        self.values = array('f', [0.0] * capacity)
+        self._head = 0   # 次に書き込む位置
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """値を追加（満杯の場合は最も古い値を上書き）"""
+        self.times[self._head] = timestamp
+        self.values[self._head] = value
+        self._head = (self._head + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def latest(self):
+        """最新の(時刻, 値)を取得"""
+        if not self._count:
+            return None
+        index = (self._head - 1) % self.capacity
+        return self.times[index], self.values[index]
+
+    def items(self, limit=None):
+        """古い順に(時刻, 値)を返す"""
+        count = self._count if limit is None else min(limit, self._count)
+        start = (self._head - count) % self.capacity
+        for i in range(count):
+            index = (start + i) % self.capacity
+            yield self.times[index], self.values[index]
+
+
+class SensorHistory:
+    """
+    複数解像度の温度履歴
+    生データに加え、1分平均と15分平均を別々のリングバッファに保持します。
+    """
+    # (名前, 集約間隔[秒], 保持数)。集約間隔0は生データ
+    RESOLUTIONS = (
+        ('raw', 0, 180),
+        ('1m', 60, 360),
+        ('15m', 900, 672),
+    )
+
+    def __init__(self, resolutions=None):
+        self.resolutions = resolutions or self.RESOLUTIONS
+        self.buffers = {}
+        self._buckets = {}  # 名前 -> [バケット番号, 合計, 件数]
+        for name, period, capacity in self.resolutions:
+            self.buffers[name] = RingBuffer(capacity)
+            if period:
+                self._buckets[name] = [None, 0.0, 0]
+
+    def add(self, timestamp, value):
+        """サンプルを追加し、各解像度へダウンサンプリング"""
+        for name, period, _ in self.resolutions:
+            if not period:
+                self.buffers[name].append(timestamp, value)
+                continue
+            bucket = self._buckets[name]
+            index = timestamp // period
+            if bucket[0] is not None and index != bucket[0]:
+                # 区間が終わったら平均値を確定して記録
+                self.buffers[name].append(bucket[0] * period, bucket[1] / bucket[2])
+                bucket[1] = 0.0
+                bucket[2] = 0
+            bucket[0] = index
+            bucket[1] += value
+            bucket[2] += 1
+
+    def latest(self):
+        """最新の生データを取得"""
+        return self.buffers[self.resolutions[0][0]].latest()
+
+    def series(self, resolution='raw', limit=None):
+        """指定した解像度の履歴を[[時刻, 値], ...]形式で取得"""
+        if resolution not in self.buffers:
+            return None
+        return [[t, round(v, 2)] for t, v in self.buffers[resolution].items(limit)]
+
+
+class TemperatureMonitor:
+    """センサーを一定間隔でサンプリングして履歴に記録"""
+    def __init__(self, sensor, history=None, interval_s=10, clock=None):
+        self.sensor = sensor
+        self.history = history or SensorHistory()
+        self.interval_s = interval_s
+        self.clock = clock or time.time
+        self._last_sample = None
+
+    def poll(self):
+        """
+        サンプリング間隔が経過していれば温度を記録する
+
+        Returns:
+            float: 記録した温度。記録しなかった場合はNone
+        """
+        now = int(self.clock())
+        if self._last_sample is not None and now - self._last_sample < self.interval_s:
+            return None
+        self._last_sample = now
+        value = self.sensor.read()
+        if value is None:
+            return None
+        self.history.add(now, value)
+        return value
+
+    def current(self):
+        """最新の温度を取得"""
+        latest = self.history.latest()
+        return None if latest is None else latest[1]
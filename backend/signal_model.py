@@ -0,0 +1,472 @@
+"""
+赤外線信号のパラメトリックモデル
+同じ機種で学習した信号同士を比較して、電源・モード・温度・風量を表すビットとチェックサムの規則を推定し、
+学習していない組み合わせの信号を合成します。
+合成は基準となる信号のパルス列をコピーし、データビットのスペース長だけを書き換えて行います。
+"""
+import json
+
+from fingerprint import estimate_unit, signal_key
+
+FIELDS = ('power_on', 'mode', 'temperature', 'fan_speed')
+NUMERIC_FIELDS = ('temperature', 'fan_speed')
+
+# パルス長の判定（基本単位に対する比）
+BIT_LIMIT = 2.0      # これより長いスペースは"1"
+HEADER_LIMIT = 6.0   # これより長いマークはリーダー
+GAP_LIMIT = 20.0     # これより長いスペースはフレーム間の空白
+
+# 一次式で合成できる値の範囲（学習した値の範囲をこの範囲まで広げる。ここに無い項目は学習した範囲のみ）
+SETPOINT_LIMITS = {'temperature': (18, 30)}
+
+
+def decode(pulses):
+    """
+    パルス列をフレームごとのビット列に分解
+
+    Returns:
+        list: フレームごとの[(ビット, スペースのインデックス), ...]
+    """
+    unit = estimate_unit(pulses)
+    frames = [[]]
+    for i in range(0, len(pulses) - 1, 2):
+        mark, space = pulses[i], pulses[i + 1]
+        if mark > unit * HEADER_LIMIT:
+            # リーダーから新しいフレームが始まる
+            if frames[-1]:
+                frames.append([])
+            continue
+        if space > unit * GAP_LIMIT:
+            frames.append([])
+            continue
+        frames[-1].append((1 if space > unit * BIT_LIMIT else 0, i + 1))
+    return [frame for frame in frames if frame]
+
+
+def to_bytes(bits):
+    """ビット列（LSBファースト）をバイト列に変換"""
+    return [sum(bits[i * 8 + k] << k for k in range(8)) for i in range(len(bits) // 8)]
+
+
+def get_bits(bits, start, width):
+    return sum(bits[start + k] << k for k in range(width))
+
+
+def set_bits(bits, start, width, value, mask=None):
+    """ビットを書き換える（maskを指定した場合は、maskが1のビットだけ）"""
+    for k in range(width):
+        if mask is None or (mask >> k) & 1:
+            bits[start + k] = (value >> k) & 1
+
+
+def _checksum(data, rule):
+    if rule == 'sum8':
+        return sum(data) & 0xff
+    if rule == 'xor8':
+        result = 0
+        for b in data:
+            result ^= b
+        return result
+    return None
+
+
+def _field_value(key, field):
+    return key[FIELDS.index(field)]
+
+
+def _parse_value(field, text):
+    """文字列で保存した項目の値を元の型に戻す"""
+    if field == 'power_on':
+        return text == 'True'
+    if field in NUMERIC_FIELDS:
+        return int(text)
+    return text
+
+
+class SignalModel:
+    """学習済み信号から推定した信号のモデル"""
+    def __init__(self, references, frames, fields, timing):
+        """
+        Args:
+            references (list): 合成の基準にする信号（辞書）のリスト
+            frames (list): フレームごとの{'length': ビット数, 'checksum': 規則またはNone}
+            fields (dict): 項目名 -> エンコード方法
+            timing (dict): {'zero': "0"のスペース長, 'one': "1"のスペース長}
+        """
+        self.references = references
+        self.frames = frames
+        self.fields = fields
+        self.timing = timing
+
+    # --- 推定 ---
+
+    @classmethod
+    def build(cls, signals, limits=None):
+        """
+        学習済み信号からモデルを推定する
+
+        Args:
+            signals (list): 学習済み信号のリスト
+            limits (dict): 項目名 -> (最小値, 最大値)。一次式で合成できる範囲（省略時はSETPOINT_LIMITS）
+
+        Returns:
+            SignalModel: 推定できなかった場合はNone
+        """
+        decoded = []
+        for signal in signals:
+            frames = decode(signal["signal_data"])
+            decoded.append((signal_key(signal), signal, [[bit for bit, _ in frame] for frame in frames]))
+        if len(decoded) < 2:
+            return None
+        # フレーム構成が異なる信号は別の機種とみなして、最も多い構成のものだけを使う
+        layouts = {}
+        for item in decoded:
+            layout = tuple(len(bits) for bits in item[2])
+            layouts.setdefault(layout, []).append(item)
+        items = max(layouts.values(), key=len)
+        if len(items) < 2:
+            return None
+        if limits is None:
+            limits = SETPOINT_LIMITS
+
+        frames = []
+        fields = {}
+        for frame_index in range(len(items[0][2])):
+            frame_bits = [item[2][frame_index] for item in items]
+            length = len(frame_bits[0])
+            data_length = length
+            checksum = None
+            if length >= 16 and length % 8 == 0:
+                for rule in ('sum8', 'xor8'):
+                    if all(to_bytes(bits)[-1] == _checksum(to_bytes(bits)[:-1], rule) for bits in frame_bits):
+                        # チェックサムが変化している場合のみ規則として採用
+                        if len(set(to_bytes(bits)[-1] for bits in frame_bits)) > 1:
+                            checksum = rule
+                            data_length = length - 8
+                        break
+            frames.append({'length': length, 'checksum': checksum})
+
+            varying = [b for b in range(data_length) if len(set(bits[b] for bits in frame_bits)) > 1]
+            if not varying:
+                continue
+            assigned = {}
+            for b in varying:
+                field = cls._explaining_field(items, frame_index, b)
+                if field is None:
+                    # どの項目でも説明できないビットがある場合は推定できない
+                    print(f"説明できないビットがあります: フレーム{frame_index} ビット{b}")
+                    return None
+                assigned.setdefault(field, []).append(b)
+            for field, positions in assigned.items():
+                # 他の項目のビットを書き換えないように、他の項目が使うビットを渡す
+                others = set(b for f, ps in assigned.items() if f != field for b in ps)
+                spec = cls._fit_field(items, frame_index, field, positions, data_length, limits, others)
+                if spec is None:
+                    print(f"項目のエンコード方法を推定できません: {field}")
+                    return None
+                fields[field] = spec
+
+        # 変化しなかった項目は、学習した値のみ対応
+        for field in FIELDS:
+            if field not in fields:
+                fields[field] = {'kind': 'const', 'values': sorted(set(str(_field_value(item[0], field)) for item in items))}
+
+        timing = cls._estimate_timing([item[1] for item in items])
+        references = [item[1] for item in items]
+        return cls(references, frames, fields, timing)
+
+    @staticmethod
+    def _explaining_field(items, frame_index, bit):
+        """ビットの値が1つの項目の値だけで決まっているかを調べる"""
+        for field in FIELDS:
+            mapping = {}
+            consistent = True
+            for key, _, frames in items:
+                value = _field_value(key, field)
+                if mapping.setdefault(value, frames[frame_index][bit]) != frames[frame_index][bit]:
+                    consistent = False
+                    break
+            if consistent and len(set(mapping.values())) > 1:
+                return field
+        return None
+
+    @staticmethod
+    def _fit_field(items, frame_index, field, positions, data_length, limits, others=()):
+        """
+        項目のエンコード方法（一次式または対応表）を推定
+
+        Args:
+            others (set): 同じフレームで他の項目が使うビットの位置（一次式の範囲に含めない）
+
+        Returns:
+            dict: エンコード方法。学習した信号と矛盾する場合はNone
+        """
+        start, end = min(positions), max(positions) + 1
+        if field in NUMERIC_FIELDS:
+            # 変化したビットを含むバイト全体を値の範囲とし、整数係数の一次式 a*x+b で表せるか試す
+            byte_start = start // 8 * 8
+            byte_end = min(data_length, (end + 7) // 8 * 8)
+            # 同じバイトに他の項目がある場合は、そのビットを除いた範囲も試す
+            trimmed_start = max([byte_start] + [b + 1 for b in others if byte_start <= b < start])
+            trimmed_end = min([byte_end] + [b for b in others if end <= b < byte_end])
+            for span_start, span_end in ((byte_start, byte_end), (trimmed_start, trimmed_end), (start, end)):
+                if any(span_start <= b < span_end for b in others):
+                    continue
+                width = span_end - span_start
+                # 同じ値の信号が複数あっても全て確かめるため、重複を除かずに集める
+                points = [(int(_field_value(key, field)), get_bits(frames[frame_index], span_start, width))
+                          for key, _, frames in items]
+                xs = sorted(set(x for x, _ in points))
+                if len(xs) < 2:
+                    break
+                y_low = [y for x, y in points if x == xs[0]][0]
+                y_high = [y for x, y in points if x == xs[-1]][0]
+                a = (y_high - y_low) // (xs[-1] - xs[0])
+                b = y_low - a * xs[0]
+                if a and all(a * x + b == y for x, y in points):
+                    low, high = xs[0], xs[-1]
+                    if field in limits:
+                        low, high = min(low, limits[field][0]), max(high, limits[field][1])
+                    return {'kind': 'linear', 'frame': frame_index, 'start': span_start, 'width': width,
+                            'a': a, 'b': b, 'min': low, 'max': high}
+        # 対応表: 範囲内に他の項目のビットがあれば、それ以外のビットだけを扱う
+        width = end - start
+        mask = sum(1 << (b - start) for b in range(start, end) if b not in others)
+        observations = {}
+        for key, _, frames in items:
+            value = str(_field_value(key, field))
+            code = get_bits(frames[frame_index], start, width) & mask
+            if observations.setdefault(value, code) != code:
+                return None
+        spec = {'kind': 'map', 'frame': frame_index, 'start': start, 'width': width, 'table': observations}
+        if mask != (1 << width) - 1:
+            spec['mask'] = mask
+        return spec
+
+    @staticmethod
+    def _estimate_timing(signals):
+        """"0"と"1"のスペース長（中央値）を推定"""
+        zeros, ones = [], []
+        for signal in signals:
+            pulses = signal["signal_data"]
+            for frame in decode(pulses):
+                for bit, index in frame:
+                    (ones if bit else zeros).append(pulses[index])
+        zeros.sort()
+        ones.sort()
+        return {'zero': zeros[len(zeros) // 2], 'one': ones[len(ones) // 2]}
+
+    # --- 合成 ---
+
+    def supports(self, power_on, mode, temperature, fan_speed):
+        """指定した組み合わせを合成できるか"""
+        key = signal_key({'power_on': power_on, 'mode': mode, 'temperature': temperature, 'fan_speed': fan_speed})
+        for field in FIELDS:
+            if self._encode(field, _field_value(key, field)) is False:
+                return False
+        return True
+
+    def _encode(self, field, value):
+        """項目の値をビット値に変換（対応していない値はFalse）"""
+        spec = self.fields[field]
+        if spec['kind'] == 'const':
+            return None if str(value) in spec['values'] else False
+        if spec['kind'] == 'linear':
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return False
+            # ビット幅に収まっても、範囲外の値（温度0度など）は合成しない
+            if 'min' not in spec or not spec['min'] <= value <= spec['max']:
+                return False
+            encoded = spec['a'] * value + spec['b']
+            return encoded if 0 <= encoded < (1 << spec['width']) else False
+        encoded = spec['table'].get(str(value))
+        return False if encoded is None else encoded
+
+    def synthesize(self, power_on, mode, temperature, fan_speed):
+        """
+        信号を合成する
+
+        Returns:
+            dict: 信号データ（record_signalで保存するものと同じ形式）。合成できない場合はNone
+        """
+        key = signal_key({'power_on': power_on, 'mode': mode, 'temperature': temperature, 'fan_speed': fan_speed})
+        encoded = {}
+        for field in FIELDS:
+            value = self._encode(field, _field_value(key, field))
+            if value is False:
+                return None
+            encoded[field] = value
+
+        # 最も多くの項目が一致する信号を基準にする
+        reference = max(self.references, key=lambda s: sum(
+            1 for f in FIELDS if _field_value(signal_key(s), f) == _field_value(key, f)))
+        pulses = list(reference["signal_data"])
+        frames = decode(pulses)
+        for frame_index, frame in enumerate(frames):
+            bits = [bit for bit, _ in frame]
+            for field, spec in self.fields.items():
+                if spec['kind'] != 'const' and spec['frame'] == frame_index:
+                    set_bits(bits, spec['start'], spec['width'], encoded[field], spec.get('mask'))
+            checksum = self.frames[frame_index]['checksum'] if frame_index < len(self.frames) else None
+            if checksum:
+                data = to_bytes(bits)
+                set_bits(bits, len(bits) - 8, 8, _checksum(data[:-1], checksum))
+            for (old_bit, index), bit in zip(frame, bits):
+                if old_bit != bit:
+                    pulses[index] = self.timing['one'] if bit else self.timing['zero']
+        return {
+            "power_on": power_on,
+            "mode": mode,
+            "temperature": temperature,
+            "fan_speed": fan_speed,
+            "signal_data": pulses,
+            "synthesized": True
+        }
+
+    def read_fields(self, pulses):
+        """
+        信号から各項目の値を読み取る（合成した信号の検証用）
+
+        Returns:
+            dict: 項目名 -> 値（変化しない項目と読み取れない値はNone）
+        """
+        frames = [[bit for bit, _ in frame] for frame in decode(pulses)]
+        values = {}
+        for field, spec in self.fields.items():
+            values[field] = None
+            if spec['kind'] == 'const' or spec['frame'] >= len(frames):
+                continue
+            code = get_bits(frames[spec['frame']], spec['start'], spec['width'])
+            if spec['kind'] == 'linear':
+                if (code - spec['b']) % spec['a'] == 0:
+                    values[field] = (code - spec['b']) // spec['a']
+                continue
+            code &= spec.get('mask', (1 << spec['width']) - 1)
+            for value, table_code in spec['table'].items():
+                if table_code == code:
+                    values[field] = _parse_value(field, value)
+        return values
+
+    def combinations(self):
+        """合成できる全ての組み合わせ"""
+        choices = []
+        for field in FIELDS:
+            spec = self.fields[field]
+            if spec['kind'] == 'linear':
+                choices.append(list(range(spec['min'], spec['max'] + 1)))
+            else:
+                texts = spec['values'] if spec['kind'] == 'const' else spec['table']
+                choices.append([_parse_value(field, text) for text in texts])
+        keys = [()]
+        for values in choices:
+            keys = [key + (value,) for key in keys for value in values]
+        return keys
+
+    # --- 保存 ---
+
+    def to_dict(self):
+        return {
+            'references': self.references,
+            'frames': self.frames,
+            'fields': self.fields,
+            'timing': self.timing,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['references'], data['frames'], data['fields'], data['timing'])
+
+    def select_references(self):
+        """合成に必要な最小限の基準信号（1つ）だけを残す"""
+        self.references = self.references[:1]
+
+
+def validate(signals):
+    """
+    モデルを検証する
+    - leave_one_out: 1つずつ学習データから外してモデルを作り、外した信号を合成できるか
+    - roundtrip: 合成できる全ての組み合わせについて、合成した信号から読み取った各項目が指定した値と一致するか
+                 （ある項目の書き込みが他の項目のビットを上書きしていないか）
+
+    Returns:
+        list: 検証結果（roundtripは不一致の組み合わせのみ）
+    """
+    report = []
+    for i, held_out in enumerate(signals):
+        key = signal_key(held_out)
+        model = SignalModel.build(signals[:i] + signals[i + 1:])
+        result = {'check': 'leave_one_out', 'key': key, 'status': 'unsupported', 'bit_errors': None}
+        if model is not None:
+            synthesized = model.synthesize(*key)
+            if synthesized is not None:
+                expected = [[bit for bit, _ in frame] for frame in decode(held_out["signal_data"])]
+                actual = [[bit for bit, _ in frame] for frame in decode(synthesized["signal_data"])]
+                errors = sum(1 for e, a in zip(sum(expected, []), sum(actual, [])) if e != a)
+                errors += abs(len(sum(expected, [])) - len(sum(actual, [])))
+                result['bit_errors'] = errors
+                result['status'] = 'ok' if errors == 0 else 'mismatch'
+        report.append(result)
+
+    model = SignalModel.build(signals)
+    if model is not None:
+        for key in model.combinations():
+            synthesized = model.synthesize(*key)
+            if synthesized is None:
+                report.append({'check': 'roundtrip', 'key': key, 'status': 'unsupported', 'bit_errors': None})
+                continue
+            values = model.read_fields(synthesized["signal_data"])
+            wrong = [f for f in FIELDS if values[f] is not None and values[f] != _field_value(key, f)]
+            if wrong:
+                report.append({'check': 'roundtrip', 'key': key, 'status': 'mismatch', 'bit_errors': None, 'fields': wrong})
+    return report
+
+
+def _load_signals(signal_dir):
+    import os
+    signals = []
+    for root, _, files in os.walk(signal_dir):
+        for name in sorted(files):
+            if name.endswith('.json') and name != 'model.json':
+                with open(os.path.join(root, name)) as f:
+                    signals.append(json.load(f))
+    return signals
+
+
+# 使用例（ホスト上でモデルを作成して検証）
+if __name__ == "__main__":
+    import sys
+    signal_dir = sys.argv[1] if len(sys.argv) > 1 else 'signal_data'
+    signals = _load_signals(signal_dir)
+    model = SignalModel.build(signals)
+    if model is None:
+        print("モデルを推定できませんでした")
+        sys.exit(1)
+
+    print("=== 推定したモデル ===")
+    for frame_index, frame in enumerate(model.frames):
+        print(f"フレーム{frame_index}: {frame['length']}ビット, チェックサム: {frame['checksum']}")
+    for field, spec in model.fields.items():
+        print(f"{field}: {spec}")
+    print(f"スペース長: {model.timing}")
+
+    report = validate(signals)
+    print("\n=== 検証（1つずつ外して合成） ===")
+    for result in report:
+        if result['check'] == 'leave_one_out':
+            print(f"{result['key']}: {result['status']} (ビット誤り: {result['bit_errors']})")
+    roundtrip = [result for result in report if result['check'] == 'roundtrip']
+    print("\n=== 検証（合成した信号から各項目を読み取り） ===")
+    print(f"{len(model.combinations())}通り中 不一致 {len(roundtrip)}件")
+    for result in roundtrip:
+        print(f"{result['key']}: {result['status']} {result.get('fields', '')}")
+
+    library_bytes = sum(len(json.dumps(s)) for s in signals)
+    model.select_references()
+    model_bytes = len(json.dumps(model.to_dict()))
+    print(f"\n信号ライブラリ: {len(signals)}件 {library_bytes:,} bytes -> モデル: {model_bytes:,} bytes")
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w') as f:
+            json.dump(model.to_dict(), f)
+        print(f"モデルを保存しました: {sys.argv[2]}")
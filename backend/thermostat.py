@@ -0,0 +1,259 @@
+"""
+室温に基づくエアコンの自動制御（サーモスタット）
+ヒステリシス制御またはPI制御で目標の状態を決め、状態が変わった時だけ赤外線信号を送信します。
+"""
+import time
+
+
+class Thermostat:
+    """室温を目標温度に保つための閉ループ制御"""
+    CONTROL_HYSTERESIS = 'hysteresis'
+    CONTROL_PI = 'pi'
+    MODES = ('cool', 'heat')
+
+    def __init__(self, controller, monitor, target=26.0, mode='cool', fan_speed=3,
+                 control='pi', hysteresis=1.0, drive_offset=3, kp=1.0, ki=0.001,
+                 min_setpoint=18, max_setpoint=30, min_hold_s=600, clock=None):
+        """
+        Args:
+            controller: control(power_on, mode, temperature, fan_speed)を持つコントローラー
+            monitor (TemperatureMonitor): 室温のモニター
+            target (float): 目標室温
+            mode (str): モード（"cool": 冷房, "heat": 暖房）
+            fan_speed (int): 風の強さ
+            control (str): 制御方式（"pi" または "hysteresis"）
+                           PIは電源を入れたまま設定温度を調整するため、圧縮機の発停と送信回数が少ない
+            hysteresis (float): ヒステリシス幅（℃）
+            drive_offset (int): ヒステリシス制御で電源オン時に目標から冷房なら下げ、暖房なら上げる設定温度（℃）
+            kp (float): PI制御の比例ゲイン
+            ki (float): PI制御の積分ゲイン（1秒あたり）
+            min_setpoint (int): エアコンに設定できる最低温度
+            max_setpoint (int): エアコンに設定できる最高温度
+            min_hold_s (int): 状態を切り替えてから次に切り替えるまでの最短時間（秒）
+                              （ヒステリシス制御では圧縮機の最短運転・停止時間になるため、10分以上にする）
+        """
+        self.controller = controller
+        self.monitor = monitor
+        self.target = target
+        self.mode = mode
+        self.fan_speed = fan_speed
+        self.control = control
+        self.hysteresis = hysteresis
+        self.drive_offset = drive_offset
+        self.kp = kp
+        self.ki = ki
+        self.min_setpoint = min_setpoint
+        self.max_setpoint = max_setpoint
+        self.min_hold_s = min_hold_s
+        self.clock = clock or time.time
+        self.enabled = False
+        self.last_key = None
+        self._last_switch = None
+        self._integral = 0.0
+        self._last_update = None
+        # 統計
+        self.sent_count = 0
+        self.suppressed_count = 0
+
+    def configure(self, enabled=None, target=None, mode=None, fan_speed=None, control=None):
+        """設定を変更"""
+        if control is not None and control not in (self.CONTROL_HYSTERESIS, self.CONTROL_PI):
+            raise ValueError(f"不明な制御方式: {control}")
+        if mode is not None and mode not in self.MODES:
+            raise ValueError(f"不明なモード: {mode}")
+        if enabled is not None:
+            self.enabled = enabled
+        changed = False
+        if target is not None and target != self.target:
+            self.target = target
+            changed = True
+        if mode is not None and mode != self.mode:
+            self.mode = mode
+            changed = True
+        if fan_speed is not None:
+            self.fan_speed = fan_speed
+        if control is not None and control != self.control:
+            self.control = control
+            changed = True
+        if changed:
+            # 目標・モード・制御方式が変わった時だけ積分値をリセット
+            self._integral = 0.0
+            self._last_update = None
+
+    def sync(self, power_on, mode, temperature, fan_speed):
+        """手動操作などで送信された状態を反映"""
+        self.last_key = self._normalize((power_on, mode, temperature, fan_speed))
+
+    def update(self):
+        """
+        最新の室温から目標状態を計算し、必要であれば信号を送信する
+
+        Returns:
+            bool: 信号を送信した場合はTrue
+        """
+        if not self.enabled:
+            return False
+        current = self.monitor.current()
+        if current is None:
+            return False
+
+        if self.control == self.CONTROL_PI:
+            key = self._pi_key(current)
+        else:
+            key = self._hysteresis_key(current)
+        if key is None:
+            return False
+        return self._apply(key)
+
+    def _direction(self):
+        """冷房なら1、暖房なら-1（室温が目標より高い時に正の誤差となるように）"""
+        return 1 if self.mode == 'cool' else -1
+
+    def _setpoint(self, offset=0):
+        return max(self.min_setpoint, min(self.max_setpoint, int(round(self.target - offset * self._direction()))))
+
+    def _hysteresis_key(self, current):
+        """
+        ヒステリシス制御: 目標±幅を超えた時だけ電源を切り替える
+        設定温度を目標と同じにするとエアコン自身の制御で目標の手前に落ち着き、電源が切り替わらないため、
+        電源オン時は目標より drive_offset だけ冷やす（暖める）方向に設定する
+        """
+        error = (current - self.target) * self._direction()
+        if error > self.hysteresis:
+            power_on = True
+        elif error < -self.hysteresis:
+            power_on = False
+        elif self.last_key is None:
+            return None
+        else:
+            # 不感帯では現在の状態を維持
+            power_on = self.last_key[0]
+        return self._normalize((power_on, self.mode, self._setpoint(self.drive_offset), self.fan_speed))
+
+    def _pi_key(self, current):
+        """PI制御: 電源は入れたまま、エアコンの設定温度を調整する"""
+        now = self.clock()
+        error = (current - self.target) * self._direction()
+        if self._last_update is not None:
+            dt = now - self._last_update
+            self._integral += error * dt
+            # ワインドアップ防止
+            limit = (self.max_setpoint - self.min_setpoint) / max(self.ki, 1e-6)
+            self._integral = max(-limit, min(limit, self._integral))
+        self._last_update = now
+        output = self.kp * error + self.ki * self._integral
+        setpoint = int(round(self.target - output * self._direction()))
+        setpoint = max(self.min_setpoint, min(self.max_setpoint, setpoint))
+        return (True, self.mode, setpoint, self.fan_speed)
+
+    def _normalize(self, key):
+        """電源オフの信号は設定温度などに関係なく同じ状態として扱う"""
+        if not key[0]:
+            return (False, key[1], None, None)
+        return key
+
+    def _apply(self, key):
+        """状態が変わった時だけ信号を送信"""
+        if key == self.last_key:
+            self.suppressed_count += 1
+            return False
+        now = self.clock()
+        if self._last_switch is not None and now - self._last_switch < self.min_hold_s:
+            # 短時間での切り替え（圧縮機の保護）を避ける
+            self.suppressed_count += 1
+            return False
+
+        power_on, mode, temperature, fan_speed = key
+        if not power_on:
+            # 電源オフは目標の設定で送信（学習済みの信号を探しやすくするため）
+            temperature = self._setpoint()
+            fan_speed = self.fan_speed
+        success = self.controller.control(
+            power_on=power_on,
+            mode=mode,
+            temperature=temperature,
+            fan_speed=fan_speed,
+            source='thermostat'
+        )
+        if success:
+            self.last_key = key
+            self._last_switch = now
+            self.sent_count += 1
+        return success
+
+    def status(self):
+        """現在の設定と統計を取得"""
+        return {
+            'enabled': self.enabled,
+            'target': self.target,
+            'mode': self.mode,
+            'fan_speed': self.fan_speed,
+            'control': self.control,
+            'current': self.monitor.current(),
+            'last_state': list(self.last_key) if self.last_key else None,
+            'sent_count': self.sent_count,
+            'suppressed_count': self.suppressed_count,
+        }
+
+
+class _SimulatedController:
+    """シミュレーション用のコントローラー（送信回数を数え、室温モデルに反映）"""
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.send_count = 0
+        self.power_cycles = 0
+
+    def control(self, power_on, mode, temperature, fan_speed, source=None):
+        self.send_count += 1
+        if power_on and not self.sensor.power_on:
+            self.power_cycles += 1
+        self.sensor.apply_state(power_on, mode, temperature)
+        return True
+
+
+def simulate(hours=24, control='pi', target=26.0, naive_interval_s=300, sample_interval_s=10):
+    """
+    サーモスタット制御と、一定間隔で信号を送り直す単純な方法を比較する
+
+    Returns:
+        dict: 送信回数と室温の統計
+    """
+    from sensor import SimulatedSensor, SensorHistory, TemperatureMonitor
+
+    results = {}
+    for name in ('naive', control):
+        sensor = SimulatedSensor(initial=29.0)
+        controller = _SimulatedController(sensor)
+        clock = [0]
+        monitor = TemperatureMonitor(sensor, SensorHistory(), sample_interval_s, clock=lambda: clock[0])
+        thermostat = Thermostat(controller, monitor, target=target, control=control, clock=lambda: clock[0])
+        thermostat.configure(enabled=True)
+
+        errors = []
+        for second in range(0, int(hours * 3600), sample_interval_s):
+            clock[0] = second
+            sensor.advance(sample_interval_s)
+            monitor.poll()
+            if name == 'naive':
+                if second % naive_interval_s == 0:
+                    controller.control(True, 'cool', int(target), 3)
+            else:
+                thermostat.update()
+            errors.append(abs(sensor.temperature - target))
+
+        results[name] = {
+            'ir_sends': controller.send_count,
+            'power_cycles': controller.power_cycles,
+            'mean_abs_error': sum(errors) / len(errors),
+            'history_points': {n: len(b) for n, b in monitor.history.buffers.items()},
+        }
+    return results
+
+
+# 使用例（ホスト上でのシミュレーション）
+if __name__ == "__main__":
+    for control in ('hysteresis', 'pi'):
+        result = simulate(hours=24 * 14, control=control)
+        print(f"=== {control} ===")
+        for name, stats in result.items():
+            print(f"{name}: 送信回数 {stats['ir_sends']}, 電源オン回数 {stats['power_cycles']}, 平均誤差 {stats['mean_abs_error']:.2f}度, 履歴 {stats['history_points']}")
@@ -0,0 +1,28 @@
+"""
+時間計測ユーティリティ
+MicroPythonのtime.ticks_*系関数を、ホスト上のシミュレーション（CPython）でも同じ名前で使えるようにします。
+"""
+import time
+
+try:
+    ticks_ms = time.ticks_ms
+    ticks_us = time.ticks_us
+    ticks_diff = time.ticks_diff
+    ticks_add = time.ticks_add
+    sleep_ms = time.sleep_ms
+except AttributeError:
+    # CPython（ホストでのシミュレーション用）
+    def ticks_ms():
+        return int(time.monotonic() * 1000)
+
+    def ticks_us():
+        return int(time.monotonic() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)